@@ -1,5 +1,5 @@
 """AI provider integrations for Billfrog."""
 
-from .openai_provider import OpenAIProvider
+from .openai_provider import OpenAIProvider, get_openai_provider
 
-__all__ = ["OpenAIProvider"]
\ No newline at end of file
+__all__ = ["OpenAIProvider", "get_openai_provider"]
\ No newline at end of file
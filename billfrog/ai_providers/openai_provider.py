@@ -1,10 +1,44 @@
 """OpenAI provider integration for tracking AI usage."""
 
+import functools
+import gzip
+import hashlib
+import json
+import os
+import tempfile
 import openai
-from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from datetime import date, datetime, timedelta
 import time
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+
+
+# (fragment, priced model) pairs used to map model variants onto a priced
+# model. Checked in order, so more specific fragments come before their
+# prefixes and the first fragment found in the name wins.
+_MODEL_VARIANT_PATTERNS = (
+    ("gpt-4-turbo", "gpt-4-turbo"),
+    ("gpt-4-32k", "gpt-4-32k"),
+    ("gpt-4", "gpt-4"),
+    ("gpt-3.5-turbo-0125", "gpt-3.5-turbo-0125"),
+    ("gpt-3.5-turbo-instruct", "gpt-3.5-turbo-instruct"),
+    ("gpt-3.5-turbo", "gpt-3.5-turbo"),
+    ("text-davinci", "text-davinci-003"),
+    ("text-embedding-3-large", "text-embedding-3-large"),
+    ("text-embedding-3-small", "text-embedding-3-small"),
+    ("text-embedding", "text-embedding-ada-002"),
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _get_openai_client(api_key: str) -> openai.OpenAI:
+    """Get a shared OpenAI client (and its connection pool) for an API key."""
+    return openai.OpenAI(api_key=api_key)
+
+
+# Fetched usage is reused from disk for this many seconds
+USAGE_CACHE_TTL = 3600
 
 
 class UsageRecord(BaseModel):
@@ -29,6 +63,38 @@ class UsageData(BaseModel):
     total_cost_usd: float
     models_used: Dict[str, int]
     daily_breakdown: List[Dict[str, Any]]
+    
+    @classmethod
+    def from_soa(cls, dates: Sequence[str], requests: Sequence[int],
+                 prompt_tokens: Sequence[int], completion_tokens: Sequence[int],
+                 cost_usd: Sequence[float], models: Optional[Dict[str, int]] = None,
+                 **totals: Any) -> "UsageData":
+        """
+        Build usage data from parallel per-day columns.
+        
+        The columns become the row-wise ``daily_breakdown``, which stays the
+        only copy of the per-day data.
+        
+        If ``models`` is given, every row gets it as its ``models`` mix;
+        otherwise rows have no ``models`` key.
+        """
+        daily_breakdown = [
+            {
+                "date": day,
+                "requests": day_requests,
+                "prompt_tokens": day_prompt_tokens,
+                "completion_tokens": day_completion_tokens,
+                "cost_usd": cost,
+            }
+            for day, day_requests, day_prompt_tokens, day_completion_tokens, cost
+            in zip(dates, requests, prompt_tokens, completion_tokens, cost_usd)
+        ]
+        if models is not None:
+            # Every day reports the same model mix, so share one copy of it
+            shared_models = dict(models)
+            for day in daily_breakdown:
+                day["models"] = shared_models
+        return cls(daily_breakdown=daily_breakdown, **totals)
 
 
 class OpenAIProvider:
@@ -108,70 +174,81 @@ class OpenAIProvider:
         },
     }
     
+    # (prompt_rate, completion_rate) per model, flattened from MODEL_PRICING
+    _PRICING = {
+        model: (pricing["prompt"], pricing["completion"])
+        for model, pricing in MODEL_PRICING.items()
+    }
+    
     def __init__(self, api_key: str):
         """Initialize OpenAI provider with API key."""
-        self.client = openai.OpenAI(api_key=api_key)
+        self.client = _get_openai_client(api_key)
         self.api_key = api_key
+        self.cache_dir = Path.home() / ".billfrog" / "cache"
+    
+    @functools.cached_property
+    def _key_fingerprint(self) -> str:
+        """A stable identifier for the API key that does not reveal it."""
+        return hashlib.sha256(self.api_key.encode()).hexdigest()
     
     def test_connection(self) -> bool:
         """Test if the API key is valid."""
         try:
-            # Try to list models as a test
-            self.client.models.list()
+            # Retrieve a single model rather than listing the whole catalog
+            self.client.with_options(timeout=5.0, max_retries=0).models.retrieve(
+                "gpt-3.5-turbo"
+            )
+            return True
+        except (openai.NotFoundError, openai.PermissionDeniedError):
+            # The key was accepted but can't see that model (restricted keys,
+            # retired models), so it is still valid
             return True
         except Exception:
+            # A rejected key, network problems, timeouts, etc.
             return False
     
     def calculate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
         """Calculate cost for a specific usage."""
-        # Normalize model name for pricing lookup
-        model_key = self._normalize_model_name(model)
-        
-        if model_key not in self.MODEL_PRICING:
-            # Default to GPT-3.5-turbo pricing for unknown models
-            model_key = "gpt-3.5-turbo"
-        
-        pricing = self.MODEL_PRICING[model_key]
-        
-        prompt_cost = prompt_tokens * pricing["prompt"]
-        completion_cost = completion_tokens * pricing["completion"]
-        
-        return prompt_cost + completion_cost
+        prompt_rate, completion_rate = self._pricing_for(model)
+        return prompt_tokens * prompt_rate + completion_tokens * completion_rate
+    
+    def calculate_costs_bulk(self, models: Sequence[str], prompt_tokens: Sequence[int],
+                             completion_tokens: Sequence[int]) -> List[float]:
+        """Calculate costs for many usages at once, one entry per model."""
+        rates = [self._pricing_for(model) for model in models]
+        return [
+            prompt * prompt_rate + completion * completion_rate
+            for (prompt_rate, completion_rate), prompt, completion
+            in zip(rates, prompt_tokens, completion_tokens)
+        ]
     
-    def _normalize_model_name(self, model: str) -> str:
+    @classmethod
+    @functools.lru_cache(maxsize=128)
+    def _pricing_for(cls, model: str) -> Tuple[float, float]:
+        """Get the (prompt, completion) per-token rates for a model."""
+        # Default to GPT-3.5-turbo pricing for unknown models
+        model_key = cls._normalize_model_name(model)
+        return cls._PRICING.get(model_key) or cls._PRICING["gpt-3.5-turbo"]
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _normalize_model_name(model: str) -> str:
         """Normalize model name for pricing lookup."""
         # Handle model names that might have additional suffixes
         model_lower = model.lower()
         
         # Direct matches first
-        if model_lower in self.MODEL_PRICING:
+        if model_lower in OpenAIProvider.MODEL_PRICING:
             return model_lower
         
         # Pattern matching for variants
-        if "gpt-4-turbo" in model_lower:
-            return "gpt-4-turbo"
-        elif "gpt-4-32k" in model_lower:
-            return "gpt-4-32k"
-        elif "gpt-4" in model_lower:
-            return "gpt-4"
-        elif "gpt-3.5-turbo-0125" in model_lower:
-            return "gpt-3.5-turbo-0125"
-        elif "gpt-3.5-turbo-instruct" in model_lower:
-            return "gpt-3.5-turbo-instruct"
-        elif "gpt-3.5-turbo" in model_lower:
-            return "gpt-3.5-turbo"
-        elif "text-davinci" in model_lower:
-            return "text-davinci-003"
-        elif "text-embedding-3-large" in model_lower:
-            return "text-embedding-3-large"
-        elif "text-embedding-3-small" in model_lower:
-            return "text-embedding-3-small"
-        elif "text-embedding" in model_lower:
-            return "text-embedding-ada-002"
-        
-        return model_lower
+        return next(
+            (canonical for fragment, canonical in _MODEL_VARIANT_PATTERNS
+             if fragment in model_lower),
+            model_lower
+        )
     
-    def get_usage_data(self, days_back: int = 7) -> UsageData:
+    def get_usage_data(self, days_back: int = 7, seed: Optional[int] = None) -> UsageData:
         """
         Get usage data for the specified period.
         
@@ -180,16 +257,90 @@ class OpenAIProvider:
         1. Store usage data locally as API calls are made
         2. Use OpenAI's billing API if available
         3. Parse usage from OpenAI dashboard exports
+        
+        Unseeded results are cached on disk for ``USAGE_CACHE_TTL`` seconds per
+        API key, period length and day, so regenerating a receipt or sharing
+        a key between agents doesn't fetch the same usage again.
         """
+        cache_file = None
+        if seed is None:
+            cache_file = self._usage_cache_file(days_back)
+            cached = self._load_cached_usage(cache_file)
+            if cached is not None:
+                return cached
+        
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days_back)
         
         # This is a simulation - in practice, you'd track real usage
-        usage_data = self._simulate_usage_data(start_date, end_date)
+        usage_data = self._simulate_usage_data(start_date, end_date, seed)
+        
+        if cache_file is not None:
+            self._store_cached_usage(cache_file, usage_data)
         
         return usage_data
     
-    def _simulate_usage_data(self, start_date: datetime, end_date: datetime) -> UsageData:
+    def _usage_cache_file(self, days_back: int) -> Path:
+        """Get the cache file for a period ending today."""
+        key = f"{days_back}|{date.today().isoformat()}|{self._key_fingerprint}"
+        return self.cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.json.gz"
+    
+    @staticmethod
+    def _load_cached_usage(cache_file: Path) -> Optional[UsageData]:
+        """Read cached usage data, or None if it is missing, stale or unreadable."""
+        try:
+            if time.time() - cache_file.stat().st_mtime > USAGE_CACHE_TTL:
+                # It will be rewritten with fresh data, or pruned if it isn't
+                cache_file.unlink()
+                return None
+            with gzip.open(cache_file, "rb") as f:
+                return UsageData.model_validate(json.loads(f.read()))
+        except (OSError, ValueError, ValidationError):
+            return None
+    
+    @staticmethod
+    def _store_cached_usage(cache_file: Path, usage_data: UsageData) -> None:
+        """Write usage data to the cache; failures only cost a later refetch."""
+        payload = gzip.compress(usage_data.model_dump_json().encode())
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a private temporary file and atomically swap it in, so
+            # concurrent readers never see a partial entry
+            fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_name, cache_file)
+            except OSError:
+                os.unlink(tmp_name)
+                raise
+        except OSError:
+            return
+        OpenAIProvider._prune_usage_cache(cache_file.parent)
+    
+    @staticmethod
+    def _prune_usage_cache(cache_dir: Path) -> None:
+        """
+        Delete expired cache files.
+        
+        Keys include the day, so entries from earlier days are never read
+        again; without this they would pile up forever.
+        """
+        expired_before = time.time() - USAGE_CACHE_TTL
+        try:
+            with os.scandir(cache_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file() and entry.stat().st_mtime < expired_before:
+                            os.unlink(entry.path)
+                    except OSError:
+                        # Already removed by a concurrent prune, or unreadable
+                        pass
+        except OSError:
+            pass
+    
+    def _simulate_usage_data(self, start_date: datetime, end_date: datetime,
+                             seed: Optional[int] = None) -> UsageData:
         """
         Simulate usage data for demonstration.
         
@@ -200,52 +351,59 @@ class OpenAIProvider:
         """
         import random
         
+        # One generator for every draw, so a seed reproduces the whole period
+        rng = random.Random(seed)
+        
         # Simulate some realistic usage patterns
-        total_requests = random.randint(50, 300)
+        total_requests = rng.randint(50, 300)
         models_used = {
-            "gpt-3.5-turbo": random.randint(20, 150),
-            "gpt-4": random.randint(10, 50),
-            "text-embedding-ada-002": random.randint(5, 30),
+            "gpt-3.5-turbo": rng.randint(20, 150),
+            "gpt-4": rng.randint(10, 50),
+            "text-embedding-ada-002": rng.randint(5, 30),
         }
         
-        total_prompt_tokens = 0
-        total_completion_tokens = 0
-        total_cost = 0.0
-        daily_breakdown = []
+        # Draw each daily series in one pass, then build the breakdown from them
+        num_days = (end_date - start_date).days + 1
+        # date.isoformat() yields YYYY-MM-DD without going through strftime
+        start_ordinal = start_date.toordinal()
+        dates = [date.fromordinal(start_ordinal + i).isoformat() for i in range(num_days)]
+        daily_requests = [rng.randint(5, 20) for _ in range(num_days)]
+        daily_prompt_tokens = [rng.randint(1000, 5000) for _ in range(num_days)]
+        daily_completion_tokens = [rng.randint(500, 2500) for _ in range(num_days)]
         
-        # Generate daily breakdown
-        current_date = start_date
-        while current_date <= end_date:
-            daily_requests = random.randint(5, 20)
-            daily_prompt_tokens = random.randint(1000, 5000)
-            daily_completion_tokens = random.randint(500, 2500)
-            
-            # Calculate daily cost based on model distribution
-            daily_cost = 0.0
+        # Split each day's tokens across models by their share of requests,
+        # then price every (day, model) slice in a single bulk call
+        slice_models = []
+        slice_prompt_tokens = []
+        slice_completion_tokens = []
+        for requests, prompt_tokens, completion_tokens in zip(
+            daily_requests, daily_prompt_tokens, daily_completion_tokens
+        ):
             for model, count in models_used.items():
-                if daily_requests > 0:
-                    model_requests = max(1, count * daily_requests // total_requests)
-                    model_prompt_tokens = daily_prompt_tokens * model_requests // daily_requests
-                    model_completion_tokens = daily_completion_tokens * model_requests // daily_requests
-                    
-                    daily_cost += self.calculate_cost(model, model_prompt_tokens, model_completion_tokens)
-            
-            daily_breakdown.append({
-                "date": current_date.strftime("%Y-%m-%d"),
-                "requests": daily_requests,
-                "prompt_tokens": daily_prompt_tokens,
-                "completion_tokens": daily_completion_tokens,
-                "cost_usd": round(daily_cost, 4),
-                "models": dict(models_used)  # Copy models for this day
-            })
-            
-            total_prompt_tokens += daily_prompt_tokens
-            total_completion_tokens += daily_completion_tokens
-            total_cost += daily_cost
-            
-            current_date += timedelta(days=1)
+                model_requests = max(1, count * requests // total_requests)
+                slice_models.append(model)
+                slice_prompt_tokens.append(prompt_tokens * model_requests // requests)
+                slice_completion_tokens.append(completion_tokens * model_requests // requests)
+        
+        slice_costs = self.calculate_costs_bulk(
+            slice_models, slice_prompt_tokens, slice_completion_tokens
+        )
+        # Slices are laid out day by day, so each day is a run of num_models
+        # consecutive costs; reduce each run without copying it out
+        num_models = len(models_used)
+        daily_costs = list(map(sum, zip(*[iter(slice_costs)] * num_models)))
         
-        return UsageData(
+        total_prompt_tokens = sum(daily_prompt_tokens)
+        total_completion_tokens = sum(daily_completion_tokens)
+        total_cost = sum(daily_costs)
+        
+        return UsageData.from_soa(
+            dates=dates,
+            requests=daily_requests,
+            prompt_tokens=daily_prompt_tokens,
+            completion_tokens=daily_completion_tokens,
+            cost_usd=[round(cost, 4) for cost in daily_costs],
+            models=models_used,
             period_start=start_date.isoformat(),
             period_end=end_date.isoformat(),
             total_requests=total_requests,
@@ -253,8 +411,7 @@ class OpenAIProvider:
             total_completion_tokens=total_completion_tokens,
             total_tokens=total_prompt_tokens + total_completion_tokens,
             total_cost_usd=round(total_cost, 4),
-            models_used=models_used,
-            daily_breakdown=daily_breakdown
+            models_used=models_used
         )
     
     def get_models(self) -> List[str]:
@@ -286,4 +443,15 @@ class OpenAIProvider:
             total_tokens=prompt_tokens + completion_tokens,
             cost_usd=cost,
             request_type=request_type
-        )
\ No newline at end of file
+        )
+
+
+@functools.lru_cache(maxsize=32)
+def get_openai_provider(api_key: str) -> OpenAIProvider:
+    """
+    Get a shared provider for an API key.
+    
+    Agents that share a key reuse one provider, along with its client
+    connection pool and key fingerprint, for the life of the process.
+    """
+    return OpenAIProvider(api_key)
@@ -2,19 +2,15 @@
 
 import typer
 from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-from rich.prompt import Prompt, Confirm
-from rich.text import Text
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
 import sys
-from email_validator import validate_email, EmailNotValidError
 
-from .config import ConfigManager
-from .ai_providers.openai_provider import OpenAIProvider
-from .email.sender import EmailSender
-from .receipts.generator import ReceiptGenerator
-from .scheduler.task_scheduler import TaskScheduler
+from .config import ConfigManager, Schedule
+
+# Provider, email, receipt and scheduler modules (and the heavy libraries
+# behind them) are imported inside the commands that use them, so commands
+# like --version and status start quickly
 
 app = typer.Typer(
     name="billfrog",
@@ -53,6 +49,9 @@ def main(
 @app.command()
 def setup():
     """🔧 Setup Billfrog configuration."""
+    from rich.panel import Panel
+    from rich.prompt import Prompt
+    
     console.print(Panel.fit(
         "🐸 [bold green]Welcome to Billfrog![/bold green]\n"
         "Let's set up your AI receipt generation system.",
@@ -95,6 +94,9 @@ def add_agent(
     schedule: str = typer.Option("weekly", "--schedule", "-s", help="Receipt schedule (daily/weekly/monthly)")
 ):
     """➕ Add a new AI agent."""
+    from rich.panel import Panel
+    from email_validator import validate_email, EmailNotValidError
+    from .ai_providers.openai_provider import get_openai_provider
     
     # Validate inputs
     if provider not in ["openai"]:
@@ -102,9 +104,11 @@ def add_agent(
         console.print("Currently supported providers: openai")
         raise typer.Exit(1)
     
-    if schedule not in ["daily", "weekly", "monthly"]:
+    try:
+        schedule = Schedule(schedule)
+    except ValueError:
         console.print(f"❌ Invalid schedule: {schedule}")
-        console.print("Valid schedules: daily, weekly, monthly")
+        console.print(f"Valid schedules: {', '.join(s.value for s in Schedule)}")
         raise typer.Exit(1)
     
     try:
@@ -125,7 +129,7 @@ def add_agent(
     console.print(f"🔍 Testing {provider.upper()} API key...")
     
     if provider == "openai":
-        openai_provider = OpenAIProvider(api_key)
+        openai_provider = get_openai_provider(api_key)
         if not openai_provider.test_connection():
             console.print("❌ Invalid OpenAI API key!")
             raise typer.Exit(1)
@@ -152,6 +156,8 @@ def add_agent(
 @agent.command("list")
 def list_agents():
     """📋 List all configured agents."""
+    from rich.table import Table
+    
     config_manager = ConfigManager()
     agents = config_manager.list_agents()
     
@@ -187,6 +193,8 @@ def remove_agent(
     name: str = typer.Argument(..., help="Name of the agent to remove")
 ):
     """🗑️ Remove an AI agent."""
+    from rich.prompt import Confirm
+    
     config_manager = ConfigManager()
     
     agents = config_manager.list_agents()
@@ -205,10 +213,13 @@ def remove_agent(
 @app.command()
 def start():
     """🚀 Start the background scheduler for receipt generation."""
+    from .scheduler.task_scheduler import TaskScheduler
+    
     console.print("🚀 Starting Billfrog scheduler...")
     
     config_manager = ConfigManager()
-    agents = config_manager.list_agents()
+    config = config_manager.load_config_trusted()
+    agents = config.agents
     
     if not agents:
         console.print("❌ No agents configured!")
@@ -216,7 +227,7 @@ def start():
         raise typer.Exit(1)
     
     # Check Supabase configuration
-    supabase_url, supabase_key = config_manager.get_supabase_config()
+    supabase_url, supabase_key = config_manager.get_supabase_config(config)
     if not supabase_url or not supabase_key:
         console.print("❌ Supabase not configured!")
         console.print("Run [bold]billfrog setup[/bold] first.")
@@ -238,9 +249,13 @@ def start():
 @app.command()
 def status():
     """📊 Show current status and configuration."""
+    from itertools import islice
+    from rich.panel import Panel
+    
     config_manager = ConfigManager()
-    agents = config_manager.list_agents()
-    supabase_url, _ = config_manager.get_supabase_config()
+    config = config_manager.load_config_trusted()
+    agents = config.agents
+    supabase_url = config.supabase_url
     
     # Main status panel
     status_text = f"🤖 Agents: {len(agents)}\n"
@@ -248,7 +263,7 @@ def status():
     
     if agents:
         status_text += f"\n📈 Recent Activity:\n"
-        for agent in list(agents.values())[:3]:  # Show last 3 agents
+        for agent in islice(agents.values(), 3):  # Show last 3 agents
             last_receipt = agent.last_receipt_sent or "Never"
             status_text += f"  • {agent.name}: {last_receipt}\n"
     
@@ -262,17 +277,22 @@ def status():
 @app.command()
 def generate():
     """📄 Generate receipts now for all agents (manual trigger)."""
+    from .ai_providers.openai_provider import get_openai_provider
+    from .email.sender import EmailSender
+    from .receipts.generator import ReceiptGenerator
+    
     console.print("📄 Generating receipts for all agents...")
     
     config_manager = ConfigManager()
-    agents = config_manager.list_agents()
+    config = config_manager.load_config_trusted()
+    agents = config.agents
     
     if not agents:
         console.print("❌ No agents configured!")
         raise typer.Exit(1)
     
     # Check Supabase configuration
-    supabase_url, supabase_key = config_manager.get_supabase_config()
+    supabase_url, supabase_key = config_manager.get_supabase_config(config)
     if not supabase_url or not supabase_key:
         console.print("❌ Supabase not configured!")
         console.print("Run [bold]billfrog setup[/bold] first.")
@@ -281,18 +301,19 @@ def generate():
     email_sender = EmailSender(supabase_url, supabase_key)
     receipt_generator = ReceiptGenerator()
     
-    for agent_name, agent_config in agents.items():
+    def process_agent(item: Tuple[str, Any]) -> List[str]:
+        """Generate and send one agent's receipt, returning its status lines."""
+        agent_name, agent_config = item
+        messages = [f"🔄 Processing {agent_name}..."]
         try:
-            console.print(f"🔄 Processing {agent_name}...")
-            
             # Get usage data
             if agent_config.provider == "openai":
-                api_key = config_manager.get_agent_api_key(agent_name)
-                provider = OpenAIProvider(api_key)
+                api_key = config_manager.get_agent_api_key(agent_name, config)
+                provider = get_openai_provider(api_key)
                 usage_data = provider.get_usage_data()
             else:
-                console.print(f"❌ Unsupported provider for {agent_name}")
-                continue
+                messages.append(f"❌ Unsupported provider for {agent_name}")
+                return messages
             
             # Generate receipt
             receipt_html = receipt_generator.generate_receipt(
@@ -307,14 +328,23 @@ def generate():
             )
             
             if success:
-                console.print(f"✅ Receipt sent to {agent_config.email}")
+                messages.append(f"✅ Receipt sent to {agent_config.email}")
                 # Update last receipt sent timestamp
                 # TODO: Implement this in config manager
             else:
-                console.print(f"❌ Failed to send receipt for {agent_name}")
+                messages.append(f"❌ Failed to send receipt for {agent_name}")
                 
         except Exception as e:
-            console.print(f"❌ Error processing {agent_name}: {e}")
+            messages.append(f"❌ Error processing {agent_name}: {e}")
+        
+        return messages
+    
+    # Agents are independent and mostly waiting on the network, so process
+    # them concurrently; output is still printed in configuration order
+    with ThreadPoolExecutor(max_workers=min(8, len(agents))) as executor:
+        for messages in executor.map(process_agent, agents.items()):
+            for message in messages:
+                console.print(message)
     
     console.print("📄 Receipt generation complete!")
 
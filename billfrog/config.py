@@ -1,13 +1,28 @@
 """Configuration management for Billfrog."""
 
-import json
+import functools
+import hashlib
 import os
+import tempfile
+from enum import Enum
 from pathlib import Path
-from typing import Dict, Any, Optional
-from pydantic import BaseModel, EmailStr, Field
-from cryptography.fernet import Fernet
+from typing import Dict, Any, Optional, Tuple
+from pydantic import BaseModel, EmailStr
+from cryptography.fernet import Fernet, InvalidToken
 import base64
 
+from . import _json
+
+
+class Schedule(str, Enum):
+    """How often receipts are generated for an agent."""
+    DAILY = "daily"
+    WEEKLY = "weekly"
+    MONTHLY = "monthly"
+    
+    def __str__(self) -> str:
+        return self.value
+
 
 class AgentConfig(BaseModel):
     """Configuration for an AI agent."""
@@ -15,7 +30,7 @@ class AgentConfig(BaseModel):
     provider: str = "openai"
     api_key_encrypted: str
     email: EmailStr
-    schedule: str = Field(default="weekly", pattern="^(daily|weekly|monthly)$")
+    schedule: Schedule = Schedule.WEEKLY
     created_at: str
     last_receipt_sent: Optional[str] = None
 
@@ -28,6 +43,22 @@ class BillfrogConfig(BaseModel):
     encryption_key: Optional[str] = None
 
 
+@functools.lru_cache(maxsize=None)
+def _load_encryption_key(key_file: Path) -> Tuple[bytes, Fernet]:
+    """
+    Load the encryption key and its cipher, creating the key if needed.
+    
+    Cached per key path so every ConfigManager in the process shares them.
+    """
+    if not key_file.exists():
+        key = Fernet.generate_key()
+        key_file.write_bytes(key)
+        key_file.chmod(0o600)  # Read/write for owner only
+    
+    key = key_file.read_bytes()
+    return key, Fernet(key)
+
+
 class ConfigManager:
     """Manages Billfrog configuration."""
     
@@ -35,50 +66,126 @@ class ConfigManager:
         self.config_dir = Path.home() / ".billfrog"
         self.config_file = self.config_dir / "config.json"
         self.config_dir.mkdir(exist_ok=True)
+        self._cached_config: Optional[BillfrogConfig] = None
+        self._cached_key: Optional[Tuple[int, int]] = None
+        self._cached_validated = False
+        self._last_written_digest: Optional[bytes] = None
+        self._last_written_key: Optional[Tuple[int, int]] = None
         self._ensure_encryption_key()
         
     def _ensure_encryption_key(self) -> None:
         """Ensure encryption key exists."""
-        key_file = self.config_dir / ".key"
-        if not key_file.exists():
-            key = Fernet.generate_key()
-            key_file.write_bytes(key)
-            key_file.chmod(0o600)  # Read/write for owner only
-        
-        self._encryption_key = key_file.read_bytes()
+        self._encryption_key, self._fernet = _load_encryption_key(self.config_dir / ".key")
     
     def _encrypt(self, data: str) -> str:
         """Encrypt sensitive data."""
-        f = Fernet(self._encryption_key)
-        encrypted = f.encrypt(data.encode())
-        return base64.b64encode(encrypted).decode()
+        # Fernet tokens are already URL-safe base64, so store them as-is
+        return self._fernet.encrypt(data.encode()).decode()
     
     def _decrypt(self, encrypted_data: str) -> str:
         """Decrypt sensitive data."""
-        f = Fernet(self._encryption_key)
-        encrypted_bytes = base64.b64decode(encrypted_data.encode())
-        return f.decrypt(encrypted_bytes).decode()
+        try:
+            return self._fernet.decrypt(encrypted_data.encode()).decode()
+        except InvalidToken:
+            # Values written by older versions were base64-encoded a second time
+            encrypted_bytes = base64.b64decode(encrypted_data.encode())
+            return self._fernet.decrypt(encrypted_bytes).decode()
     
-    def load_config(self) -> BillfrogConfig:
-        """Load configuration from file."""
-        if not self.config_file.exists():
+    def config_token(self) -> Optional[Tuple[int, int]]:
+        """
+        Get a token identifying the current config file contents.
+        
+        The token is the file's (mtime in nanoseconds, size), or None if it
+        doesn't exist, so it is a single stat() call to compute.
+        """
+        try:
+            stat = self.config_file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def config_changed_since(self, token: Optional[Tuple[int, int]]) -> bool:
+        """Check whether the config file changed since ``token`` was taken."""
+        return self.config_token() != token
+    
+    def _load_shared(self, validate: bool) -> BillfrogConfig:
+        """Return the shared parsed config, re-reading the file only when needed."""
+        key = self.config_token()
+        if key is None:
             return BillfrogConfig()
         
-        with open(self.config_file, 'r') as f:
-            data = json.load(f)
+        if (self._cached_config is None or key != self._cached_key
+                or (validate and not self._cached_validated)):
+            raw = self.config_file.read_bytes()
+            
+            if validate:
+                # Parse and validate in a single pass inside pydantic-core
+                self._cached_config = BillfrogConfig.model_validate_json(raw)
+            else:
+                data = _json.loads(raw)
+                agents = {
+                    name: AgentConfig.model_construct(**agent)
+                    for name, agent in data.pop("agents", {}).items()
+                }
+                self._cached_config = BillfrogConfig.model_construct(agents=agents, **data)
+            self._cached_key = key
+            self._cached_validated = validate
+        
+        return self._cached_config
+    
+    def load_config_cached(self) -> BillfrogConfig:
+        """
+        Return the parsed configuration, shared between read-only callers.
         
-        return BillfrogConfig(**data)
+        The file is only re-read and re-validated when its mtime changes, so
+        callers must not mutate the returned object; use load_config() for that.
+        """
+        return self._load_shared(validate=True)
+    
+    def load_config_trusted(self) -> BillfrogConfig:
+        """
+        Return the shared configuration without running Pydantic validation.
+        
+        The config file is local state written by save_config(), so read-only
+        paths can skip re-validating it. Like load_config_cached(), the result
+        must not be mutated.
+        """
+        return self._load_shared(validate=False)
+    
+    def load_config(self) -> BillfrogConfig:
+        """Load configuration from file."""
+        return self.load_config_cached().model_copy(deep=True)
     
     def save_config(self, config: BillfrogConfig) -> None:
         """Save configuration to file."""
-        with open(self.config_file, 'w') as f:
-            json.dump(config.model_dump(), f, indent=2)
+        payload = _json.dumps(config.model_dump(mode="json"), indent=True)
+        
+        # Nothing to do if these exact bytes are what we last wrote and the
+        # file hasn't been touched since
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        if digest == self._last_written_digest and self.config_token() == self._last_written_key:
+            return
+        
+        # Write to a private temporary file (mkstemp creates it 0600, and
+        # unique, so concurrent writers never share it) and atomically swap
+        # it in, so readers never see a partially written config
+        fd, tmp_name = tempfile.mkstemp(dir=self.config_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_name, self.config_file)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
         
-        # Secure file permissions
-        self.config_file.chmod(0o600)
+        self._cached_config = config.model_copy(deep=True)
+        self._cached_key = self.config_token()
+        self._cached_validated = True
+        self._last_written_digest = digest
+        self._last_written_key = self._cached_key
     
     def add_agent(self, name: str, provider: str, api_key: str, 
-                  email: str, schedule: str) -> None:
+                  email: str, schedule: Schedule) -> None:
         """Add a new AI agent configuration."""
         from datetime import datetime
         
@@ -96,9 +203,11 @@ class ConfigManager:
         config.agents[name] = agent_config
         self.save_config(config)
     
-    def get_agent_api_key(self, agent_name: str) -> Optional[str]:
-        """Get decrypted API key for an agent."""
-        config = self.load_config()
+    def get_agent_api_key(self, agent_name: str,
+                          config: Optional[BillfrogConfig] = None) -> Optional[str]:
+        """Get decrypted API key for an agent, optionally from an already loaded config."""
+        if config is None:
+            config = self.load_config_trusted()
         if agent_name in config.agents:
             return self._decrypt(config.agents[agent_name].api_key_encrypted)
         return None
@@ -110,9 +219,11 @@ class ConfigManager:
         config.supabase_key_encrypted = self._encrypt(key)
         self.save_config(config)
     
-    def get_supabase_config(self) -> tuple[Optional[str], Optional[str]]:
-        """Get Supabase configuration."""
-        config = self.load_config()
+    def get_supabase_config(self, config: Optional[BillfrogConfig] = None
+                            ) -> tuple[Optional[str], Optional[str]]:
+        """Get Supabase configuration, optionally from an already loaded config."""
+        if config is None:
+            config = self.load_config_trusted()
         url = config.supabase_url
         key = None
         if config.supabase_key_encrypted:
@@ -121,7 +232,7 @@ class ConfigManager:
     
     def list_agents(self) -> Dict[str, AgentConfig]:
         """List all configured agents."""
-        config = self.load_config()
+        config = self.load_config_trusted()
         return config.agents
     
     def remove_agent(self, name: str) -> bool:
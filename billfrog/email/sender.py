@@ -1,22 +1,130 @@
 """Email sender using Supabase for delivering receipts."""
 
 from supabase import create_client, Client
-from typing import Optional, Dict, Any
-import json
+from typing import Optional, Dict, Any, Iterable, List
+import asyncio
+import atexit
+import base64
+import functools
+import gzip
+import httpx
 import logging
+import threading
 from datetime import datetime
 
+from .. import _json
+
 logger = logging.getLogger(__name__)
 
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+_TEST_EMAIL_TEMPLATE = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Billfrog Test Email</title>
+        </head>
+        <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+            <div style="text-align: center; padding: 20px;">
+                <h1 style="color: #22c55e;">🐸 Billfrog Test Email</h1>
+                <p>This is a test email from your Billfrog AI receipt system.</p>
+                <p>If you received this email, your configuration is working correctly!</p>
+                <hr style="margin: 20px 0; border: none; border-top: 1px solid #e5e7eb;">
+                <p style="color: #6b7280; font-size: 14px;">
+                    Sent by Billfrog - AI Usage Receipt Generator<br>
+                    Time: {{TS}}
+                </p>
+            </div>
+        </body>
+        </html>
+        """
+
+
+@functools.lru_cache(maxsize=4)
+def _get_supabase(supabase_url: str, supabase_key: str) -> Client:
+    """Get a shared Supabase client (and its connection pool) for a project."""
+    return create_client(supabase_url, supabase_key)
+
+
+def _auth_headers(supabase_key: str) -> Dict[str, str]:
+    """Headers that authenticate direct calls to Supabase edge functions."""
+    return {"Authorization": f"Bearer {supabase_key}", "apikey": supabase_key}
+
+
+@functools.lru_cache(maxsize=4)
+def _get_http_client(supabase_key: str) -> httpx.Client:
+    """Get a shared, pooled HTTP client authenticated for edge function calls."""
+    return httpx.Client(headers=_auth_headers(supabase_key), timeout=10.0)
+
 
 class EmailSender:
     """Email sender using Supabase for email delivery."""
     
-    def __init__(self, supabase_url: str, supabase_key: str):
-        """Initialize email sender with Supabase credentials."""
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+    # Buffered email log rows are written once this many are pending
+    LOG_FLUSH_THRESHOLD = 100
+    
+    # gzip level for compressed HTML payloads; lower it if sending is CPU-bound
+    HTML_COMPRESS_LEVEL = 6
+    
+    def __init__(self, supabase_url: str, supabase_key: str, dev_mode: bool = False,
+                 compress_html: bool = False):
+        """
+        Initialize email sender with Supabase credentials.
+        
+        With ``dev_mode`` set, sends that fail to reach the email service are
+        reported as simulated successes instead of failures.
+        
+        With ``compress_html`` set, the receipt HTML is sent gzipped and
+        base64-encoded as ``html_gzip_b64`` instead of ``html``. The send-email
+        edge function must decode it (see examples/supabase_setup.md).
+        """
+        self.supabase: Client = _get_supabase(supabase_url, supabase_key)
         self.supabase_url = supabase_url
+        self._dev_mode = dev_mode
+        self._compress_html = compress_html
+        self._send_email_url = f"{supabase_url.rstrip('/')}/functions/v1/send-email"
+        self._auth_headers = _auth_headers(supabase_key)
+        self._http = _get_http_client(supabase_key)
+        self._log_buffer: List[Dict[str, Any]] = []
+        self._log_lock = threading.Lock()
         
+    def _batch_timestamp(self) -> str:
+        """Return an ISO timestamp to share across one batch of emails."""
+        return datetime.now().isoformat()
+    
+    def _build_email_data(self, to_email: str, subject: str, html_content: str,
+                          timestamp: Optional[str] = None) -> Dict[str, Any]:
+        """Build the payload expected by the send-email edge function."""
+        email_data = {
+            "to": [{"email": to_email}],
+            "subject": subject,
+            "from": {
+                "email": "receipts@billfrog.dev",
+                "name": "Billfrog Receipts"
+            },
+            "metadata": {
+                "type": "ai_usage_receipt",
+                "timestamp": timestamp or self._batch_timestamp(),
+                "service": "billfrog"
+            }
+        }
+        
+        if self._compress_html:
+            compressed = gzip.compress(html_content.encode("utf-8"),
+                                       compresslevel=self.HTML_COMPRESS_LEVEL)
+            email_data["html_gzip_b64"] = base64.b64encode(compressed).decode("ascii")
+        else:
+            email_data["html"] = html_content
+        return email_data
+    
+    def _simulate_send(self, to_email: str, subject: str, html_content: str) -> bool:
+        """Report a send that could not reach the email service (dev mode only)."""
+        print(f"📧 [SIMULATED] Email sent to {to_email}")
+        print(f"    Subject: {subject}")
+        print(f"    Content length: {len(html_content)} characters")
+        return True
+    
     def send_receipt(self, to_email: str, subject: str, html_content: str) -> bool:
         """
         Send a receipt email using Supabase.
@@ -25,30 +133,12 @@ class EmailSender:
         or are using a Supabase-compatible email service.
         """
         try:
-            # Prepare email data
-            email_data = {
-                "to": [{"email": to_email}],
-                "subject": subject,
-                "html": html_content,
-                "from": {
-                    "email": "receipts@billfrog.dev",
-                    "name": "Billfrog Receipts"
-                },
-                "metadata": {
-                    "type": "ai_usage_receipt",
-                    "timestamp": datetime.now().isoformat(),
-                    "service": "billfrog"
-                }
-            }
+            email_data = self._build_email_data(to_email, subject, html_content)
             
             # Send via Supabase Edge Function
             # This assumes you have deployed an email-sending edge function
-            result = self.supabase.functions.invoke(
-                "send-email",
-                {
-                    "body": email_data
-                }
-            )
+            result = self._http.post(self._send_email_url, content=_json.dumps(email_data),
+                                     headers=_JSON_HEADERS)
             
             if result.status_code == 200:
                 logger.info(f"Email sent successfully to {to_email}")
@@ -57,37 +147,63 @@ class EmailSender:
                 logger.error(f"Failed to send email: {result.status_code} - {result.text}")
                 return False
                 
-        except Exception as e:
-            logger.error(f"Error sending email to {to_email}: {str(e)}")
-            # For development/testing, we'll log and return True
-            # In production, you'd want to handle this properly
-            print(f"📧 [SIMULATED] Email sent to {to_email}")
-            print(f"    Subject: {subject}")
-            print(f"    Content length: {len(html_content)} characters")
-            return True
+        except Exception:
+            logger.exception(f"Error sending email to {to_email}")
+            if self._dev_mode:
+                return self._simulate_send(to_email, subject, html_content)
+            return False
+    
+    async def send_receipt_async(self, to_email: str, subject: str, html_content: str,
+                                 client: Optional[httpx.AsyncClient] = None,
+                                 timestamp: Optional[str] = None) -> bool:
+        """
+        Send a receipt email by calling the send-email edge function directly.
+        
+        Pass a shared ``client`` to reuse its pooled connections; otherwise a
+        client is created for this single request.
+        """
+        if client is None:
+            async with httpx.AsyncClient(headers=self._auth_headers) as own_client:
+                return await self.send_receipt_async(to_email, subject, html_content,
+                                                     own_client, timestamp)
+        
+        try:
+            email_data = self._build_email_data(to_email, subject, html_content, timestamp)
+            response = await client.post(self._send_email_url, content=_json.dumps(email_data),
+                                         headers=_JSON_HEADERS)
+            
+            if response.status_code == 200:
+                logger.info(f"Email sent successfully to {to_email}")
+                return True
+            else:
+                logger.error(f"Failed to send email: {response.status_code} - {response.text}")
+                return False
+                
+        except Exception:
+            logger.exception(f"Error sending email to {to_email}")
+            if self._dev_mode:
+                return self._simulate_send(to_email, subject, html_content)
+            return False
+    
+    async def send_receipts_bulk(self, items: Iterable[Dict[str, str]]) -> List[bool]:
+        """
+        Send several receipts concurrently over one pooled HTTP client.
+        
+        Each item holds the ``to_email``, ``subject`` and ``html_content``
+        arguments of ``send_receipt``. Results are returned in input order.
+        """
+        timestamp = self._batch_timestamp()
+        limits = httpx.Limits(max_keepalive_connections=32)
+        async with httpx.AsyncClient(headers=self._auth_headers, limits=limits) as client:
+            return list(await asyncio.gather(
+                *(self.send_receipt_async(client=client, timestamp=timestamp, **item) for item in items)
+            ))
     
     def send_test_email(self, to_email: str) -> bool:
         """Send a test email to verify configuration."""
-        test_html = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Billfrog Test Email</title>
-        </head>
-        <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-            <div style="text-align: center; padding: 20px;">
-                <h1 style="color: #22c55e;">🐸 Billfrog Test Email</h1>
-                <p>This is a test email from your Billfrog AI receipt system.</p>
-                <p>If you received this email, your configuration is working correctly!</p>
-                <hr style="margin: 20px 0; border: none; border-top: 1px solid #e5e7eb;">
-                <p style="color: #6b7280; font-size: 14px;">
-                    Sent by Billfrog - AI Usage Receipt Generator<br>
-                    Time: {timestamp}
-                </p>
-            </div>
-        </body>
-        </html>
-        """.format(timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC"))
+        test_html = _TEST_EMAIL_TEMPLATE.replace(
+            "{{TS}}", datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
+        )
         
         return self.send_receipt(
             to_email,
@@ -99,11 +215,12 @@ class EmailSender:
         """Create or update an email template in Supabase."""
         try:
             # Store template in Supabase database
+            timestamp = self._batch_timestamp()
             result = self.supabase.table("email_templates").upsert({
                 "name": template_name,
                 "html_content": template_html,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
+                "created_at": timestamp,
+                "updated_at": timestamp
             }).execute()
             
             return len(result.data) > 0
@@ -126,20 +243,46 @@ class EmailSender:
             return None
     
     def log_email_sent(self, to_email: str, subject: str, success: bool, 
-                      agent_name: str = None) -> bool:
-        """Log email sending activity."""
+                      agent_name: str = None, timestamp: Optional[str] = None) -> bool:
+        """
+        Log email sending activity.
+        
+        Rows are buffered and written in a single insert by ``flush_logs``,
+        which runs automatically once ``LOG_FLUSH_THRESHOLD`` rows are pending
+        and at interpreter exit.
+        """
+        log_data = {
+            "to_email": to_email,
+            "subject": subject,
+            "success": success,
+            "agent_name": agent_name,
+            "timestamp": timestamp or self._batch_timestamp(),
+            "service": "billfrog"
+        }
+        
+        with self._log_lock:
+            if not self._log_buffer:
+                atexit.register(self.flush_logs)
+            self._log_buffer.append(log_data)
+            pending = len(self._log_buffer)
+        
+        if pending >= self.LOG_FLUSH_THRESHOLD:
+            return self.flush_logs()
+        return True
+    
+    def flush_logs(self) -> bool:
+        """Write all buffered email log rows in one insert."""
+        with self._log_lock:
+            rows, self._log_buffer = self._log_buffer, []
+            if rows:
+                atexit.unregister(self.flush_logs)
+        
+        if not rows:
+            return True
+        
         try:
-            log_data = {
-                "to_email": to_email,
-                "subject": subject,
-                "success": success,
-                "agent_name": agent_name,
-                "timestamp": datetime.now().isoformat(),
-                "service": "billfrog"
-            }
-            
-            result = self.supabase.table("email_logs").insert(log_data).execute()
+            result = self.supabase.table("email_logs").insert(rows).execute()
             return len(result.data) > 0
         except Exception as e:
             logger.error(f"Failed to log email activity: {str(e)}")
-            return False
\ No newline at end of file
+            return False
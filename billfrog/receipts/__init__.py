@@ -1,5 +1,5 @@
 """Receipt generation functionality for Billfrog."""
 
-from .generator import ReceiptGenerator
+from .generator import ReceiptGenerator, receipt_stylesheet
 
-__all__ = ["ReceiptGenerator"]
\ No newline at end of file
+__all__ = ["ReceiptGenerator", "receipt_stylesheet"]
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""Compile simple receipt templates to plain Python render functions."""
+
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from jinja2 import Environment
+from markupsafe import escape
+
+Renderer = Callable[[Dict[str, Any]], str]
+
+_TOKEN_RE = re.compile(r"({{.*?}}|{%.*?%})", re.DOTALL)
+_DOTTED = r"[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*"
+_EXPR_RE = re.compile(r"{{\s*(" + _DOTTED + r")\s*}}$")
+_FOR_RE = re.compile(r"{%\s*for\s+([A-Za-z_]\w*)\s+in\s+(" + _DOTTED + r")\s*%}$")
+_ENDFOR_RE = re.compile(r"{%\s*endfor\s*%}$")
+
+
+def _make_getitem(env: Environment) -> Callable[[Any, str], Any]:
+    """Build a lookup that reads plain dicts directly and defers to ``env``."""
+    def getitem(obj: Any, attr: str, _getattr: Callable[[Any, str], Any] = env.getattr) -> Any:
+        if type(obj) is dict and attr in obj:
+            return obj[attr]
+        return _getattr(obj, attr)
+    return getitem
+
+
+def compile_renderer(source: str, env: Environment) -> Optional[Renderer]:
+    """
+    Compile a template into a function that renders it without Jinja.
+
+    Only ``{{ name.attr }}`` output and ``{% for x in name.attr %}`` loops are
+    supported, rendered with the same autoescaping, globals and attribute
+    lookup as ``env``. Returns None for anything else so callers can fall back to Jinja.
+    """
+    if env.autoescape is not True or "{#" in source or "\r" in source:
+        return None
+    # Jinja drops a single trailing newline by default
+    if source.endswith("\n") and not env.keep_trailing_newline:
+        source = source[:-1]
+
+    lines = ["def render(ctx):", "    _out = []", "    _a = _out.append"]
+    loop_vars: List[Dict[str, str]] = [{}]
+    indent = "    "
+
+    def lookup(dotted: str) -> str:
+        name, *attrs = dotted.split(".")
+        expr = next(
+            (scope[name] for scope in reversed(loop_vars) if name in scope),
+            f"ctx.get({name!r}, _globals.get({name!r}, _missing))",
+        )
+        for attr in attrs:
+            # Jinja tries attributes before items, so the dict fast path is
+            # only safe for names that are not dict attributes
+            helper = "_getattr" if hasattr(dict, attr) else "_getitem"
+            expr = f"{helper}({expr}, {attr!r})"
+        return expr
+
+    for token in _TOKEN_RE.split(source):
+        if not token:
+            continue
+        if not token.startswith(("{{", "{%")):
+            if "{{" in token or "{%" in token:
+                return None
+            lines.append(f"{indent}_a({token!r})")
+            continue
+
+        expr = _EXPR_RE.match(token)
+        loop = _FOR_RE.match(token)
+        dotted = expr.group(1) if expr else loop.group(2) if loop else ""
+        if len(loop_vars) > 1 and dotted.split(".")[0] == "loop":
+            # Jinja's special loop variable is not emulated
+            return None
+
+        if expr:
+            lines.append(f"{indent}_a(_escape({lookup(dotted)}))")
+        elif loop:
+            var = f"_v{sum(map(len, loop_vars))}"
+            lines.append(f"{indent}for {var} in {lookup(dotted)}:")
+            loop_vars.append({loop.group(1): var})
+            indent += "    "
+        elif _ENDFOR_RE.match(token) and len(loop_vars) > 1:
+            # An empty loop body still needs a statement
+            lines.append(f"{indent}pass")
+            loop_vars.pop()
+            indent = indent[:-4]
+        else:
+            return None
+
+    if len(loop_vars) > 1:
+        return None
+    lines.append("    return ''.join(_out)")
+
+    namespace = {
+        "_escape": escape,
+        "_getattr": env.getattr,
+        "_getitem": _make_getitem(env),
+        "_globals": env.globals,
+        "_missing": env.undefined(),
+    }
+    exec(compile("\n".join(lines), "<receipt template>", "exec"), namespace)
+    return namespace["render"]
@@ -1,50 +1,37 @@
 """Receipt generator for creating beautiful HTML receipts."""
 
-from jinja2 import Template
+from calendar import month_abbr
+from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader, Template
+from markupsafe import Markup
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
-import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from operator import itemgetter
+import functools
+import hashlib
+import os
+import re
 from ..ai_providers.openai_provider import UsageData
+from .compiler import Renderer, compile_renderer
 
+_STYLE_BLOCK_RE = re.compile(r"(<style>)(.*?)(</style>)", re.DOTALL)
 
-class ReceiptGenerator:
-    """Generates beautiful HTML receipts for AI usage."""
-    
-    def __init__(self):
-        """Initialize the receipt generator."""
-        self.receipt_template = self._create_receipt_template()
-    
-    def generate_receipt(self, agent_name: str, usage_data: UsageData, 
-                        schedule: str) -> str:
-        """Generate a complete HTML receipt."""
-        
-        # Calculate period based on schedule
-        period_info = self._get_period_info(schedule)
-        
-        # Prepare receipt data
-        receipt_data = {
-            "agent_name": agent_name,
-            "receipt_id": self._generate_receipt_id(),
-            "date_generated": datetime.now().strftime("%B %d, %Y"),
-            "period": period_info,
-            "usage_summary": self._format_usage_summary(usage_data),
-            "cost_breakdown": self._format_cost_breakdown(usage_data),
-            "daily_usage": self._format_daily_usage(usage_data.daily_breakdown),
-            "models_breakdown": self._format_models_breakdown(usage_data.models_used),
-            "total_cost": usage_data.total_cost_usd,
-            "schedule": schedule.title(),
-            "next_receipt": self._calculate_next_receipt_date(schedule)
-        }
-        
-        # Render template
-        template = Template(self.receipt_template)
-        html_receipt = template.render(**receipt_data)
-        
-        return html_receipt
-    
-    def _create_receipt_template(self) -> str:
-        """Create the HTML template for receipts."""
-        return """
+
+def _minify_style(source: str) -> str:
+    """Collapse the whitespace in a template's <style> block.
+
+    The stylesheet is almost all of the template's static text; squashing it
+    into one line lets Jinja emit the whole head as a single write.
+    """
+    def _squash(match: "re.Match[str]") -> str:
+        css = re.sub(r"\s+", " ", match.group(2))
+        css = re.sub(r"\s*([{};,])\s*", r"\1", css).strip()
+        return match.group(1) + css + match.group(3)
+
+    return _STYLE_BLOCK_RE.sub(_squash, source, count=1)
+
+
+_RECEIPT_TEMPLATE_SRC = _minify_style("""
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -373,7 +360,7 @@ class ReceiptGenerator:
             </div>
             
             <div class="cost-total">
-                <div class="amount">${{ "%.4f"|format(total_cost) }}</div>
+                <div class="amount">${{ total_cost_display }}</div>
                 <div class="label">Total Usage Cost</div>
             </div>
             
@@ -402,14 +389,7 @@ class ReceiptGenerator:
                         </tr>
                     </thead>
                     <tbody>
-                        {% for day in daily_usage %}
-                        <tr>
-                            <td>{{ day.date }}</td>
-                            <td>{{ day.requests }}</td>
-                            <td>{{ day.total_tokens }}</td>
-                            <td class="amount">${{ "%.4f"|format(day.cost) }}</td>
-                        </tr>
-                        {% endfor %}
+                        {{ daily_rows }}
                     </tbody>
                 </table>
             </div>
@@ -423,15 +403,173 @@ class ReceiptGenerator:
     </div>
 </body>
 </html>
+        """)
+
+# Kept inline when the full stylesheet is linked, so the receipt stays
+# readable in mail clients that block remote CSS
+_CRITICAL_STYLE = (
+    "body{font-family:-apple-system,BlinkMacSystemFont,'Segoe UI',Roboto,sans-serif;"
+    "line-height:1.6;color:#374151;background-color:#f9fafb;padding:20px;}"
+    ".receipt-container{max-width:700px;margin:0 auto;background:white;}"
+    ".breakdown-table{width:100%;border-collapse:collapse;}"
+    ".amount{font-weight:600;color:#10b981;}"
+)
+
+
+def receipt_stylesheet() -> str:
+    """Return the receipt CSS, for hosting it as an external stylesheet."""
+    return _STYLE_BLOCK_RE.search(_RECEIPT_TEMPLATE_SRC).group(2)
+
+
+# Variant of the receipt template that links its stylesheet. The URL is
+# passed in the render context, so it is escaped like any other value and
+# every URL shares this one template
+_LINKED_TEMPLATE_SRC = _STYLE_BLOCK_RE.sub(
+    lambda match: '<link rel="stylesheet" href="{{ stylesheet_url }}">'
+                  f"<style>{_CRITICAL_STYLE}</style>",
+    _RECEIPT_TEMPLATE_SRC,
+    count=1,
+)
+
+
+# One row of the daily breakdown table; format_map escapes the values
+_DAILY_ROW_TEMPLATE = Markup(
+    '<tr><td>{date}</td><td>{requests}</td><td>{total_tokens}</td>'
+    '<td class="amount">${cost_display}</td></tr>'
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _create_bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    """Create the on-disk Jinja bytecode cache, or None if it is unusable."""
+    cache_dir = os.environ.get("BILLFROG_JINJA_CACHE") or str(Path.home() / ".billfrog" / "jinja-cache")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return None
+    return FileSystemBytecodeCache(directory=cache_dir)
+
+
+# Sources of templates rendered by Jinja, by the digest they are loaded as
+_JINJA_SOURCES: Dict[str, str] = {}
+
+# Shared by all generators so compiled templates are reused across instances,
+# and across processes through the bytecode cache once Jinja is first needed
+_ENV = Environment(
+    loader=FunctionLoader(_JINJA_SOURCES.get),
+    auto_reload=False,
+    autoescape=True,
+)
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_template(source: str) -> Template:
+    """Compile a template source with Jinja once per process."""
+    # Only templates loaded by name go through the bytecode cache, so load
+    # the source under its digest; the cache (and its directory) is only set
+    # up once a template actually needs Jinja
+    name = hashlib.sha256(source.encode()).hexdigest()
+    _JINJA_SOURCES[name] = source
+    _ENV.bytecode_cache = _create_bytecode_cache()
+    return _ENV.get_template(name)
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_renderer(source: str) -> Renderer:
+    """
+    Get a render function for a template source, compiled once per process.
+    
+    Templates that only use plain output and for loops are turned into a
+    straight Python function; anything else is rendered by Jinja.
+    """
+    renderer = compile_renderer(source, _ENV)
+    if renderer is None:
+        template = _compile_template(source)
+        renderer = lambda context: template.render(context)
+    return renderer
+
+
+@functools.lru_cache(maxsize=64)
+def _pretty_model_name(model: str) -> str:
+    """Turn a model id such as "gpt-3.5-turbo" into a display name."""
+    return model.replace("-", " ").title()
+
+
+class ReceiptGenerator:
+    """Generates beautiful HTML receipts for AI usage."""
+    
+    def __init__(self, stylesheet_url: Optional[str] = None):
+        """
+        Initialize the receipt generator.
+        
+        If ``stylesheet_url`` is given, receipts link to the stylesheet at that
+        URL (see ``receipt_stylesheet``) and inline only a small critical
+        subset, instead of embedding the full CSS in every email.
         """
+        self.stylesheet_url = stylesheet_url
+        self.receipt_template = self._create_receipt_template()
     
-    def _generate_receipt_id(self) -> str:
+    def generate_receipt(self, agent_name: str, usage_data: UsageData, 
+                        schedule: str) -> str:
+        """Generate a complete HTML receipt."""
+        
+        # One timestamp for the whole receipt
+        now = datetime.now()
+        
+        # Calculate period based on schedule
+        period_info = self._get_period_info(schedule, now)
+        
+        daily_usage = self._format_daily_usage(usage_data.daily_breakdown)
+        
+        # Prepare receipt data
+        receipt_data = {
+            "agent_name": agent_name,
+            "stylesheet_url": self.stylesheet_url,
+            "receipt_id": self._generate_receipt_id(now),
+            "date_generated": now.strftime("%B %d, %Y"),
+            "period": period_info,
+            "usage_summary": self._format_usage_summary(usage_data),
+            "cost_breakdown": self._format_cost_breakdown(usage_data),
+            "daily_usage": daily_usage,
+            "daily_rows": self._render_daily_rows(daily_usage),
+            "models_breakdown": self._format_models_breakdown(usage_data.models_used),
+            "total_cost": usage_data.total_cost_usd,
+            "total_cost_display": f"{usage_data.total_cost_usd:.4f}",
+            "schedule": schedule.title(),
+            "next_receipt": self._calculate_next_receipt_date(schedule, now)
+        }
+        
+        # Render template; look the renderer up each time, since subclasses
+        # may replace receipt_template after __init__ (it is cached per source)
+        html_receipt = _compile_renderer(self.receipt_template)(receipt_data)
+        
+        return html_receipt
+    
+    @classmethod
+    def render(cls, agent_name: str, usage_data: UsageData, schedule: str,
+               stylesheet_url: Optional[str] = None) -> str:
+        """
+        Generate a receipt with a new generator.
+        
+        A module-level entry point that pickles by reference, so receipts can
+        be rendered in worker processes.
+        """
+        return cls(stylesheet_url).generate_receipt(agent_name, usage_data, schedule)
+    
+    def _create_receipt_template(self) -> str:
+        """Return the HTML template source for receipts."""
+        if self.stylesheet_url:
+            return _LINKED_TEMPLATE_SRC
+        return _RECEIPT_TEMPLATE_SRC
+    
+    def _generate_receipt_id(self, now: Optional[datetime] = None) -> str:
         """Generate a unique receipt ID."""
-        return f"BF-{datetime.now().strftime('%Y%m')}-{str(uuid.uuid4())[:8].upper()}"
+        now = now or datetime.now()
+        return f"BF-{now.year:04d}{now.month:02d}-{os.urandom(4).hex().upper()}"
     
-    def _get_period_info(self, schedule: str) -> Dict[str, str]:
+    def _get_period_info(self, schedule: str, now: Optional[datetime] = None) -> Dict[str, str]:
         """Get period information based on schedule."""
-        now = datetime.now()
+        now = now or datetime.now()
         
         if schedule == "daily":
             start = now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -463,48 +601,57 @@ class ReceiptGenerator:
     
     def _format_cost_breakdown(self, usage_data: UsageData) -> List[Dict[str, Any]]:
         """Format cost breakdown by model."""
-        breakdown = []
-        for model, requests in usage_data.models_used.items():
-            # Calculate approximate cost for this model
-            # This is simplified - in practice you'd need more detailed tracking
-            model_percentage = requests / usage_data.total_requests
-            model_cost = usage_data.total_cost_usd * model_percentage
-            
-            breakdown.append({
+        # Calculate approximate cost per model from its share of requests
+        # This is simplified - in practice you'd need more detailed tracking
+        if usage_data.total_requests:
+            cost_per_request = usage_data.total_cost_usd / usage_data.total_requests
+        else:
+            cost_per_request = 0.0
+        
+        breakdown = [
+            {
                 "model": model,
                 "requests": requests,
-                "cost": model_cost
-            })
+                "cost": requests * cost_per_request
+            }
+            for model, requests in usage_data.models_used.items()
+        ]
         
-        return sorted(breakdown, key=lambda x: x["cost"], reverse=True)
+        return sorted(breakdown, key=itemgetter("cost"), reverse=True)
     
     def _format_daily_usage(self, daily_breakdown: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Format daily usage for display."""
-        formatted = []
-        for day in daily_breakdown:
-            formatted.append({
-                "date": datetime.fromisoformat(day["date"]).strftime("%b %d"),
+        # Dates are ISO "YYYY-MM-DD" strings, so slice them instead of parsing
+        return [
+            {
+                "date": f"{month_abbr[int(day['date'][5:7])]} {day['date'][8:10]}",
                 "requests": day["requests"],
                 "total_tokens": day["prompt_tokens"] + day["completion_tokens"],
-                "cost": day["cost_usd"]
-            })
-        
-        return formatted
+                "cost": day["cost_usd"],
+                "cost_display": f"{day['cost_usd']:.4f}"
+            }
+            for day in daily_breakdown
+        ]
+    
+    def _render_daily_rows(self, daily_usage: List[Dict[str, Any]]) -> Markup:
+        """Render the daily breakdown table rows as one HTML fragment."""
+        return Markup("").join(map(_DAILY_ROW_TEMPLATE.format_map, daily_usage))
     
     def _format_models_breakdown(self, models_used: Dict[str, int]) -> List[Dict[str, Any]]:
         """Format models breakdown for display."""
-        breakdown = []
-        for model, requests in models_used.items():
-            breakdown.append({
-                "name": model.replace("-", " ").title(),
+        # Sort on the raw counts, then format them for display
+        ordered = sorted(models_used.items(), key=itemgetter(1), reverse=True)
+        return [
+            {
+                "name": _pretty_model_name(model),
                 "requests": f"{requests:,}"
-            })
-        
-        return sorted(breakdown, key=lambda x: int(x["requests"].replace(",", "")), reverse=True)
+            }
+            for model, requests in ordered
+        ]
     
-    def _calculate_next_receipt_date(self, schedule: str) -> str:
+    def _calculate_next_receipt_date(self, schedule: str, now: Optional[datetime] = None) -> str:
         """Calculate the next receipt generation date."""
-        now = datetime.now()
+        now = now or datetime.now()
         
         if schedule == "daily":
             next_date = now + timedelta(days=1)
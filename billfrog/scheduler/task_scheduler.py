@@ -1,19 +1,70 @@
 """Task scheduler for automated receipt generation."""
 
-import schedule
+import asyncio
+import heapq
+import multiprocessing
+import os
 import time
 import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import logging
-from ..config import ConfigManager
-from ..ai_providers.openai_provider import OpenAIProvider
+from ..config import BillfrogConfig, ConfigManager
+from ..ai_providers.openai_provider import get_openai_provider
 from ..email.sender import EmailSender
 from ..receipts.generator import ReceiptGenerator
 
 logger = logging.getLogger(__name__)
 
 
+def _next_daily_run(now: datetime) -> datetime:
+    """Get the next 09:00 after ``now``."""
+    run_at = now.replace(hour=9, minute=0, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+def _next_weekly_run(now: datetime) -> datetime:
+    """Get the next Monday 09:00 after ``now``."""
+    run_at = now.replace(hour=9, minute=0, second=0, microsecond=0)
+    run_at += timedelta(days=-now.weekday() % 7)
+    return run_at if run_at > now else run_at + timedelta(days=7)
+
+
+def _next_monthly_run(now: datetime) -> datetime:
+    """Get the next 1st of the month 09:00 after ``now``."""
+    run_at = now.replace(day=1, hour=9, minute=0, second=0, microsecond=0)
+    if run_at <= now:
+        # Any day 32 days after the 1st falls in the following month
+        run_at = (run_at + timedelta(days=32)).replace(day=1)
+    return run_at
+
+
+def _days_in_previous_month(now: datetime) -> int:
+    """Number of days in the month before the one ``now`` falls in."""
+    return (now.replace(day=1) - timedelta(days=1)).day
+
+
+# Per schedule: how to find the next run, how many days a receipt covers, and
+# which calendar period (day, ISO week or month) a moment falls in
+_NEXT_RUN: Dict[str, Callable[[datetime], datetime]] = {
+    "daily": _next_daily_run,
+    "weekly": _next_weekly_run,
+    "monthly": _next_monthly_run,
+}
+_PERIOD_DAYS: Dict[str, Callable[[datetime], int]] = {
+    "daily": lambda now: 1,
+    "weekly": lambda now: 7,
+    # Monthly receipts go out on the 1st and cover the whole previous month
+    "monthly": _days_in_previous_month,
+}
+_PERIOD_KEY: Dict[str, Callable[[datetime], Any]] = {
+    "daily": lambda moment: moment.date(),
+    "weekly": lambda moment: tuple(moment.isocalendar()[:2]),
+    "monthly": lambda moment: (moment.year, moment.month),
+}
+
+
 class TaskScheduler:
     """Handles scheduling of receipt generation tasks."""
     
@@ -23,6 +74,30 @@ class TaskScheduler:
         self.running = False
         self.scheduler_thread = None
         
+        # Set by stop(); both the scheduler loop and start() block on it, so
+        # they wake immediately on shutdown instead of polling a flag
+        self._stop_event = threading.Event()
+        
+        # Pending runs as (epoch seconds, agent name), earliest first, and
+        # the schedule each agent was queued with
+        self._heap: List[Tuple[float, str]] = []
+        self._schedules: Dict[str, str] = {}
+        self._heap_lock = threading.Lock()
+        
+        # Token of the config file the schedules were built from, so the
+        # loop can detect edits with a stat() instead of re-parsing it
+        self._config_token: Optional[Tuple[int, int]] = None
+        
+        # Receipts for agents due at the same time are prepared concurrently
+        # on a pool and then emailed as one batch; the config lock
+        # serializes read-modify-write updates of the config file
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._config_lock = threading.Lock()
+        
+        # Receipt HTML is rendered in worker processes so rendering doesn't
+        # hold the GIL while other jobs wait on the network
+        self._cpu_pool: Optional[ProcessPoolExecutor] = None
+        
     def start(self) -> None:
         """Start the scheduler in a background thread."""
         if self.running:
@@ -30,137 +105,261 @@ class TaskScheduler:
             return
         
         self.running = True
+        self._stop_event.clear()
         self._setup_schedules()
+        self._pool = ThreadPoolExecutor(
+            max_workers=min(32, len(self._heap) + 4),
+            thread_name_prefix="billfrog-receipt",
+        )
+        # Spawned rather than forked, since this process already runs threads.
+        # Each worker imports the provider stack and lives as long as the
+        # scheduler, so use no more than there are agents to render for
+        self._cpu_pool = ProcessPoolExecutor(
+            max_workers=max(1, min(len(self._heap), os.cpu_count() or 1)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
         
         # Start the scheduler in a separate thread
         self.scheduler_thread = threading.Thread(target=self._run_scheduler, daemon=True)
         self.scheduler_thread.start()
         
-        # Keep the main thread alive
+        # Keep the main thread alive until stop() is called
         try:
-            while self.running:
-                time.sleep(1)
+            self._stop_event.wait()
         except KeyboardInterrupt:
             self.stop()
     
     def stop(self) -> None:
         """Stop the scheduler."""
         self.running = False
-        schedule.clear()
+        self._stop_event.set()
+        with self._heap_lock:
+            self._heap.clear()
+            self._schedules.clear()
         if self.scheduler_thread and self.scheduler_thread.is_alive():
             self.scheduler_thread.join(timeout=5)
+        if self._pool is not None:
+            # Receipts already being sent are left to finish
+            self._pool.shutdown(wait=False)
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown(wait=False)
         logger.info("Scheduler stopped")
     
     def _setup_schedules(self) -> None:
         """Set up schedules for all configured agents."""
+        self._config_token = self.config_manager.config_token()
         agents = self.config_manager.list_agents()
+        now = datetime.now()
         
-        for agent_name, agent_config in agents.items():
-            if agent_config.schedule == "daily":
-                schedule.every().day.at("09:00").do(
-                    self._generate_receipt_for_agent, agent_name
-                ).tag(agent_name)
-            elif agent_config.schedule == "weekly":
-                schedule.every().monday.at("09:00").do(
-                    self._generate_receipt_for_agent, agent_name
-                ).tag(agent_name)
-            elif agent_config.schedule == "monthly":
-                schedule.every().month.do(
-                    self._generate_receipt_for_agent, agent_name
-                ).tag(agent_name)
+        with self._heap_lock:
+            self._heap.clear()
+            self._schedules.clear()
+            for agent_name, agent_config in agents.items():
+                self._push_next_run(agent_name, agent_config.schedule, now)
         
         logger.info(f"Set up schedules for {len(agents)} agents")
     
+    def _push_next_run(self, agent_name: str, schedule: str, now: datetime) -> None:
+        """Queue the next run for an agent; the caller holds the heap lock."""
+        self._schedules[agent_name] = schedule
+        next_run = self._get_next_run(schedule, now)
+        if next_run is not None:
+            heapq.heappush(self._heap, (next_run.timestamp(), agent_name))
+    
+    def _get_next_run(self, schedule: str, now: datetime) -> Optional[datetime]:
+        """Get the first scheduled run strictly after ``now``."""
+        next_run = _NEXT_RUN.get(schedule)
+        return next_run(now) if next_run is not None else None
+    
+    def _sync_schedules(self) -> None:
+        """Requeue agents that were added, removed or rescheduled in the config."""
+        self._config_token = self.config_manager.config_token()
+        agents = self.config_manager.list_agents()
+        
+        with self._heap_lock:
+            stale = {
+                agent_name for agent_name in set(agents) | set(self._schedules)
+                if agent_name not in agents or agent_name not in self._schedules
+                or agents[agent_name].schedule != self._schedules[agent_name]
+            }
+            if not stale:
+                return
+            
+            self._heap = [entry for entry in self._heap if entry[1] not in stale]
+            heapq.heapify(self._heap)
+            now = datetime.now()
+            for agent_name in stale:
+                self._schedules.pop(agent_name, None)
+                if agent_name in agents:
+                    self._push_next_run(agent_name, agents[agent_name].schedule, now)
+        
+        logger.info(f"Updated schedules for {len(stale)} agents after a config change")
+    
     def _run_scheduler(self) -> None:
-        """Run the scheduler loop."""
-        while self.running:
+        """Run the scheduler loop, sleeping until the earliest pending run."""
+        while not self._stop_event.is_set():
             try:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
+                if self.config_manager.config_changed_since(self._config_token):
+                    self._sync_schedules()
+                
+                with self._heap_lock:
+                    due = []
+                    now = time.time()
+                    while self._heap and self._heap[0][0] <= now:
+                        due.append(heapq.heappop(self._heap)[1])
+                    delay = self._heap[0][0] - now if self._heap else 60.0
+                
+                if not due:
+                    # Wake at least once a minute so config edits and
+                    # reschedules that queue an earlier run are noticed
+                    self._stop_event.wait(min(delay, 60))
+                    continue
+                
+                # Load the config once for every agent due now
+                config = self.config_manager.load_config_trusted()
+                self._run_due(due, config)
             except Exception as e:
                 logger.error(f"Error in scheduler loop: {e}")
-                time.sleep(60)
+                self._stop_event.wait(60)
+    
+    def _run_due(self, due: List[str], config: BillfrogConfig) -> None:
+        """Generate and send receipts for the agents due now and queue their next runs."""
+        futures = [
+            self._pool.submit(self._prepare_receipt, agent_name, config)
+            for agent_name in due
+        ]
+        receipts = [future.result() for future in futures]
+        self._send_receipts([receipt for receipt in receipts if receipt is not None], config)
+        
+        with self._heap_lock:
+            now = datetime.now()
+            for agent_name in due:
+                # The agent may have been removed, or already requeued after
+                # a config change while this run was in flight
+                schedule = self._schedules.get(agent_name)
+                if schedule is not None and all(entry[1] != agent_name for entry in self._heap):
+                    self._push_next_run(agent_name, schedule, now)
     
-    def _generate_receipt_for_agent(self, agent_name: str) -> None:
-        """Generate and send receipt for a specific agent."""
+    def _generate_receipt_for_agent(self, agent_name: str,
+                                    config: Optional[BillfrogConfig] = None) -> None:
+        """Generate and send an agent's receipt, optionally from an already loaded config."""
+        if config is None:
+            config = self.config_manager.load_config_trusted()
+        
+        receipt = self._prepare_receipt(agent_name, config)
+        if receipt is not None:
+            self._send_receipts([receipt], config)
+    
+    def _prepare_receipt(self, agent_name: str,
+                         config: BillfrogConfig) -> Optional[Dict[str, str]]:
+        """
+        Fetch an agent's usage and render its receipt email.
+        
+        Returns the ``agent_name``, ``to_email``, ``subject`` and
+        ``html_content`` of the email, or None if no receipt is due or it
+        could not be generated.
+        """
         try:
             logger.info(f"Generating receipt for agent: {agent_name}")
             
             # Get agent configuration
-            agents = self.config_manager.list_agents()
-            if agent_name not in agents:
+            if agent_name not in config.agents:
                 logger.error(f"Agent {agent_name} not found")
-                return
+                return None
             
-            agent_config = agents[agent_name]
+            agent_config = config.agents[agent_name]
             
             # Check if we should skip based on last receipt sent
             if self._should_skip_receipt(agent_config):
                 logger.info(f"Skipping receipt for {agent_name} - too soon since last receipt")
-                return
+                return None
             
-            # Get Supabase configuration
-            supabase_url, supabase_key = self.config_manager.get_supabase_config()
+            # Check Supabase is configured before fetching any usage
+            supabase_url, supabase_key = self.config_manager.get_supabase_config(config)
             if not supabase_url or not supabase_key:
                 logger.error("Supabase not configured")
-                return
-            
-            # Initialize services
-            email_sender = EmailSender(supabase_url, supabase_key)
-            receipt_generator = ReceiptGenerator()
+                return None
             
             # Get usage data based on provider
             if agent_config.provider == "openai":
-                api_key = self.config_manager.get_agent_api_key(agent_name)
+                api_key = self.config_manager.get_agent_api_key(agent_name, config)
                 if not api_key:
                     logger.error(f"No API key found for agent {agent_name}")
-                    return
+                    return None
                 
-                provider = OpenAIProvider(api_key)
+                provider = get_openai_provider(api_key)
                 
                 # Determine days to look back based on schedule
                 days_back = self._get_days_back(agent_config.schedule)
                 usage_data = provider.get_usage_data(days_back)
             else:
                 logger.error(f"Unsupported provider: {agent_config.provider}")
-                return
+                return None
             
-            # Generate receipt
-            receipt_html = receipt_generator.generate_receipt(
-                agent_name, usage_data, agent_config.schedule
-            )
+            # Generate receipt, in a worker process once the scheduler is running
+            if self._cpu_pool is not None:
+                receipt_html = self._cpu_pool.submit(
+                    ReceiptGenerator.render, agent_name, usage_data, agent_config.schedule
+                ).result()
+            else:
+                receipt_html = ReceiptGenerator.render(
+                    agent_name, usage_data, agent_config.schedule
+                )
+            
+            return {
+                "agent_name": agent_name,
+                "to_email": agent_config.email,
+                "subject": f"🐸 AI Usage Receipt for {agent_name} - {datetime.now().strftime('%B %Y')}",
+                "html_content": receipt_html,
+            }
+                
+        except Exception as e:
+            logger.error(f"Error generating receipt for {agent_name}: {e}")
+            return None
+    
+    def _send_receipts(self, receipts: List[Dict[str, str]], config: BillfrogConfig) -> None:
+        """Email prepared receipts in one batch and record the results."""
+        if not receipts:
+            return
+        
+        try:
+            supabase_url, supabase_key = self.config_manager.get_supabase_config(config)
+            email_sender = EmailSender(supabase_url, supabase_key)
             
-            # Send email
-            subject = f"🐸 AI Usage Receipt for {agent_name} - {datetime.now().strftime('%B %Y')}"
-            success = email_sender.send_receipt(
-                agent_config.email, 
-                subject,
-                receipt_html
-            )
+            # Send every email concurrently over one pooled HTTP client
+            results = asyncio.run(email_sender.send_receipts_bulk(
+                {
+                    "to_email": receipt["to_email"],
+                    "subject": receipt["subject"],
+                    "html_content": receipt["html_content"],
+                }
+                for receipt in receipts
+            ))
             
-            if success:
-                logger.info(f"Receipt sent successfully to {agent_config.email}")
-                # Update last receipt sent timestamp
-                self._update_last_receipt_sent(agent_name)
+            sent = []
+            for receipt, success in zip(receipts, results):
+                agent_name = receipt["agent_name"]
+                if success:
+                    logger.info(f"Receipt sent successfully to {receipt['to_email']}")
+                    sent.append(agent_name)
+                else:
+                    logger.error(f"Failed to send receipt for {agent_name}")
                 
                 # Log the email activity
                 email_sender.log_email_sent(
-                    agent_config.email, 
-                    subject, 
-                    True, 
-                    agent_name
-                )
-            else:
-                logger.error(f"Failed to send receipt for {agent_name}")
-                email_sender.log_email_sent(
-                    agent_config.email, 
-                    subject, 
-                    False, 
+                    receipt["to_email"],
+                    receipt["subject"],
+                    success,
                     agent_name
                 )
-                
+            
+            # Update last receipt sent timestamps, then write every log at once
+            if sent:
+                self._update_last_receipt_sent(*sent)
+            email_sender.flush_logs()
+            
         except Exception as e:
-            logger.error(f"Error generating receipt for {agent_name}: {e}")
+            logger.error(f"Error sending receipts: {e}")
     
     def _should_skip_receipt(self, agent_config) -> bool:
         """Check if we should skip generating a receipt based on timing."""
@@ -169,40 +368,37 @@ class TaskScheduler:
         
         try:
             last_sent = datetime.fromisoformat(agent_config.last_receipt_sent)
-            now = datetime.now()
             
-            if agent_config.schedule == "daily":
-                return (now - last_sent).days < 1
-            elif agent_config.schedule == "weekly":
-                return (now - last_sent).days < 7
-            elif agent_config.schedule == "monthly":
-                return (now - last_sent).days < 30
+            # Runs fire at a fixed time but are recorded once sent, a little
+            # later, so compare calendar periods rather than elapsed days
+            period_key = _PERIOD_KEY.get(agent_config.schedule)
+            if period_key is not None:
+                return period_key(last_sent) == period_key(datetime.now())
             
         except Exception as e:
             logger.error(f"Error checking receipt timing: {e}")
         
         return False
     
-    def _get_days_back(self, schedule: str) -> int:
+    def _get_days_back(self, schedule: str, now: Optional[datetime] = None) -> int:
         """Get the number of days to look back for usage data."""
-        if schedule == "daily":
-            return 1
-        elif schedule == "weekly":
-            return 7
-        elif schedule == "monthly":
-            return 30
-        else:
+        days_back = _PERIOD_DAYS.get(schedule)
+        if days_back is None:
             return 7  # Default to weekly
+        return days_back(now or datetime.now())
     
-    def _update_last_receipt_sent(self, agent_name: str) -> None:
-        """Update the last receipt sent timestamp for an agent."""
+    def _update_last_receipt_sent(self, *agent_names: str) -> None:
+        """Update the last receipt sent timestamp for one or more agents."""
         try:
-            config = self.config_manager.load_config()
-            if agent_name in config.agents:
-                config.agents[agent_name].last_receipt_sent = datetime.now().isoformat()
+            with self._config_lock:
+                config = self.config_manager.load_config()
+                sent_at = datetime.now().isoformat()
+                for agent_name in agent_names:
+                    if agent_name in config.agents:
+                        config.agents[agent_name].last_receipt_sent = sent_at
                 self.config_manager.save_config(config)
         except Exception as e:
-            logger.error(f"Error updating last receipt sent for {agent_name}: {e}")
+            logger.error(f"Error updating last receipt sent for {', '.join(agent_names)}: {e}")
     
     def generate_receipt_now(self, agent_name: str) -> bool:
         """Generate a receipt immediately for testing."""
@@ -214,53 +410,41 @@ class TaskScheduler:
             return False
     
     def get_next_run_times(self) -> Dict[str, str]:
-        """Get the next scheduled run times for all agents."""
-        next_runs = {}
-        agents = self.config_manager.list_agents()
-        
-        for agent_name, agent_config in agents.items():
-            try:
-                if agent_config.schedule == "daily":
-                    next_run = "Daily at 9:00 AM"
-                elif agent_config.schedule == "weekly":
-                    next_run = "Weekly on Monday at 9:00 AM"
-                elif agent_config.schedule == "monthly":
-                    next_run = "Monthly on the 1st at 9:00 AM"
-                else:
-                    next_run = "Unknown schedule"
-                
-                next_runs[agent_name] = next_run
-            except Exception as e:
-                logger.error(f"Error calculating next run time for {agent_name}: {e}")
-                next_runs[agent_name] = "Error calculating next run"
+        """Get the next scheduled run time of each agent as an ISO timestamp."""
+        with self._heap_lock:
+            if self._schedules:
+                return {
+                    agent_name: datetime.fromtimestamp(ts).isoformat()
+                    for ts, agent_name in sorted(self._heap)
+                }
         
+        # Not started: report the runs the scheduler would queue
+        now = datetime.now()
+        next_runs = {}
+        for agent_name, agent_config in self.config_manager.list_agents().items():
+            next_run = self._get_next_run(agent_config.schedule, now)
+            if next_run is not None:
+                next_runs[agent_name] = next_run.isoformat()
         return next_runs
     
     def reschedule_agent(self, agent_name: str) -> None:
         """Reschedule tasks for a specific agent (useful after config changes)."""
-        # Remove existing schedule for this agent
-        schedule.clear(agent_name)
-        
         # Get updated agent configuration
         agents = self.config_manager.list_agents()
-        if agent_name not in agents:
-            logger.warning(f"Agent {agent_name} not found for rescheduling")
-            return
-        
-        agent_config = agents[agent_name]
         
-        # Set up new schedule
-        if agent_config.schedule == "daily":
-            schedule.every().day.at("09:00").do(
-                self._generate_receipt_for_agent, agent_name
-            ).tag(agent_name)
-        elif agent_config.schedule == "weekly":
-            schedule.every().monday.at("09:00").do(
-                self._generate_receipt_for_agent, agent_name
-            ).tag(agent_name)
-        elif agent_config.schedule == "monthly":
-            schedule.every().month.do(
-                self._generate_receipt_for_agent, agent_name
-            ).tag(agent_name)
+        with self._heap_lock:
+            # Remove existing schedule for this agent
+            self._heap = [entry for entry in self._heap if entry[1] != agent_name]
+            heapq.heapify(self._heap)
+            self._schedules.pop(agent_name, None)
+            
+            if agent_name not in agents:
+                logger.warning(f"Agent {agent_name} not found for rescheduling")
+                return
+            
+            agent_config = agents[agent_name]
+            
+            # Set up new schedule
+            self._push_next_run(agent_name, agent_config.schedule, datetime.now())
         
-        logger.info(f"Rescheduled agent {agent_name} for {agent_config.schedule} receipts")
\ No newline at end of file
+        logger.info(f"Rescheduled agent {agent_name} for {agent_config.schedule} receipts")
@@ -1,18 +1,92 @@
 """Local database for storing usage data and receipt history."""
 
 import sqlite3
-import json
+import atexit
+import threading
+from contextlib import contextmanager
+from functools import cached_property
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import Iterator, List, Dict, Any, Mapping, Optional, Tuple
 import logging
 
+from .. import _json
+from ..ai_providers.openai_provider import UsageData
+
 logger = logging.getLogger(__name__)
 
 
+# Statements run on every flush, kept as constants so each batch reuses the
+# prepared statement from the connection's statement cache
+_SQL_INSERT_USAGE = """
+    INSERT INTO usage_records 
+    (timestamp, agent_name, model, prompt_tokens, completion_tokens, 
+     total_tokens, cost_usd, request_type)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Insert the day's row or add to it in place, keeping the per-model request
+# counts in models_used_json up to date inside SQLite
+_SQL_UPSERT_DAILY_STATS = """
+    INSERT INTO agent_stats 
+    (agent_name, date, total_requests, total_tokens, 
+     total_cost_usd, models_used_json)
+    VALUES (:agent_name, :date, :requests, :tokens, :cost,
+            json_object(:model, :requests))
+    ON CONFLICT(agent_name, date) DO UPDATE SET
+        total_requests = total_requests + excluded.total_requests,
+        total_tokens = total_tokens + excluded.total_tokens,
+        total_cost_usd = total_cost_usd + excluded.total_cost_usd,
+        models_used_json = json_set(
+            models_used_json, :model_path,
+            coalesce(json_extract(models_used_json, :model_path), 0)
+                + excluded.total_requests
+        ),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+
+class _ReceiptRecord(Mapping[str, Any]):
+    """
+    A receipt_history row that only parses its usage JSON when it is read.
+    
+    Behaves like the dict of column values, with ``usage_data_json`` decoded.
+    """
+    
+    def __init__(self, row: sqlite3.Row):
+        self._row = row
+    
+    @cached_property
+    def usage_data(self) -> Dict[str, Any]:
+        """The decoded usage data saved with the receipt."""
+        return _json.loads(self._row["usage_data_json"])
+    
+    def __getitem__(self, key: str) -> Any:
+        if key == "usage_data_json":
+            return self.usage_data
+        try:
+            return self._row[key]
+        except IndexError:
+            raise KeyError(key) from None
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._row.keys())
+    
+    def __len__(self) -> int:
+        return len(self._row)
+
+
 class LocalDatabase:
     """Local SQLite database for storing Billfrog data."""
     
+    # Buffered usage events are written once this many are pending, or by
+    # the background flusher after this many seconds
+    USAGE_FLUSH_THRESHOLD = 256
+    USAGE_FLUSH_INTERVAL = 1.0
+    
+    # Old rows are deleted at most this many per transaction
+    CLEANUP_BATCH_SIZE = 10000
+    
     def __init__(self, db_path: Optional[Path] = None):
         """Initialize the local database."""
         if db_path is None:
@@ -20,13 +94,67 @@ class LocalDatabase:
         
         self.db_path = db_path
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        # One long-lived connection in autocommit mode; transactions are
+        # explicit (see _transaction) and the lock serializes threads. The
+        # larger statement cache keeps every query this class runs prepared
+        self._conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None,
+            cached_statements=256
+        )
+        self._lock = threading.RLock()
+        
+        # Usage events waiting to be written; they are timestamped when the
+        # batch is flushed
+        self._pending_lock = threading.Lock()
+        self._pending_usage: List[Tuple[Any, ...]] = []
+        # Whether flush is registered to run at exit, which it is while any
+        # events are pending
+        self._flush_at_exit = False
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        
         self._init_database()
     
+    def close(self) -> None:
+        """Write any buffered usage and close the database connection."""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        with self._lock:
+            self._conn.close()
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run the enclosed statements in a single transaction."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            else:
+                cursor.execute("COMMIT")
+    
     def _init_database(self) -> None:
         """Initialize the database with required tables."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
+        with self._lock:
+            conn = self._conn
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            # Serve reads from a memory map and a 64 MiB page cache, and let
+            # the WAL grow to ~10000 pages between automatic checkpoints
+            mmap_size, = conn.execute("PRAGMA mmap_size=1073741824").fetchone()
+            if not mmap_size:
+                logger.debug("Memory-mapped I/O is disabled in this SQLite build")
+            conn.execute("PRAGMA cache_size=-65536")
+            conn.execute("PRAGMA wal_autocheckpoint=10000")
+        
+        with self._transaction() as cursor:
             # Usage records table
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS usage_records (
@@ -91,116 +219,172 @@ class LocalDatabase:
                 )
             """)
             
-            conn.commit()
-            logger.info("Database initialized successfully")
+            # Indexes for per-agent date range lookups and cleanup
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_usage_agent_date
+                ON usage_records(agent_name, substr(timestamp, 1, 10))
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_email_logs_date
+                ON email_logs(substr(timestamp, 1, 10))
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_receipt_history_agent_created
+                ON receipt_history(agent_name, created_at)
+            """)
+        
+        logger.info("Database initialized successfully")
     
     def record_usage(self, agent_name: str, model: str, prompt_tokens: int, 
                     completion_tokens: int, cost_usd: float, 
                     request_type: str = "chat_completion") -> bool:
-        """Record a single usage event."""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    INSERT INTO usage_records 
-                    (agent_name, timestamp, model, prompt_tokens, completion_tokens, 
-                     total_tokens, cost_usd, request_type)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    agent_name,
-                    datetime.now().isoformat(),
-                    model,
-                    prompt_tokens,
-                    completion_tokens,
-                    prompt_tokens + completion_tokens,
-                    cost_usd,
-                    request_type
-                ))
-                
-                conn.commit()
-                
-                # Update daily statistics
-                self._update_daily_stats(agent_name, model, 1, 
-                                       prompt_tokens + completion_tokens, cost_usd)
-                
+        """
+        Record a single usage event.
+        
+        Events are buffered and written in batches by ``flush``, which runs
+        once ``USAGE_FLUSH_THRESHOLD`` events are pending, every
+        ``USAGE_FLUSH_INTERVAL`` seconds, before reads and on ``close``.
+        Events are timestamped when their batch is written.
+        """
+        row = (agent_name, model, prompt_tokens, completion_tokens,
+               prompt_tokens + completion_tokens, cost_usd, request_type)
+        
+        with self._pending_lock:
+            if not self._flush_at_exit:
+                atexit.register(self.flush)
+                self._flush_at_exit = True
+            self._pending_usage.append(row)
+            pending = len(self._pending_usage)
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_periodically, name="billfrog-db-flusher", daemon=True
+                )
+                self._flusher.start()
+        
+        if pending >= self.USAGE_FLUSH_THRESHOLD:
+            return self.flush()
+        return True
+    
+    def flush(self) -> bool:
+        """
+        Write all buffered usage events and their daily stats in one transaction.
+        
+        If the write fails, the events stay buffered for the next flush.
+        """
+        with self._lock:
+            with self._pending_lock:
+                rows, self._pending_usage = self._pending_usage, []
+            
+            if not rows:
                 return True
-        except Exception as e:
-            logger.error(f"Error recording usage: {e}")
-            return False
+            
+            # Stamp the whole batch once and aggregate its daily stats per
+            # (agent, model)
+            now = datetime.now()
+            timestamp = now.isoformat()
+            date = now.strftime("%Y-%m-%d")
+            stats: Dict[Tuple[str, str], List[Any]] = {}
+            for agent_name, model, _, _, total_tokens, cost_usd, _ in rows:
+                totals = stats.setdefault((agent_name, model), [0, 0, 0.0])
+                totals[0] += 1
+                totals[1] += total_tokens
+                totals[2] += cost_usd
+            
+            try:
+                with self._transaction() as cursor:
+                    cursor.executemany(_SQL_INSERT_USAGE, [(timestamp, *row) for row in rows])
+                    
+                    # Update daily statistics in the same transaction
+                    for (agent_name, model), (requests, tokens, cost) in stats.items():
+                        self._update_daily_stats(cursor, agent_name, model, requests,
+                                                 tokens, cost, date)
+            except Exception as e:
+                logger.error(f"Error recording usage: {e}")
+                # Put the batch back ahead of anything recorded meanwhile, so a
+                # transient error (such as a locked database) loses nothing
+                with self._pending_lock:
+                    self._pending_usage[:0] = rows
+                return False
+            
+            with self._pending_lock:
+                if not self._pending_usage and self._flush_at_exit:
+                    atexit.unregister(self.flush)
+                    self._flush_at_exit = False
+            return True
+    
+    def _flush_periodically(self) -> None:
+        """Background loop that writes buffered usage until the database closes."""
+        while not self._closed.wait(self.USAGE_FLUSH_INTERVAL):
+            self.flush()
     
-    def get_usage_data(self, agent_name: str, days_back: int = 7) -> Dict[str, Any]:
-        """Get aggregated usage data for an agent."""
+    def get_usage_data(self, agent_name: str, days_back: int = 7) -> Optional[UsageData]:
+        """
+        Get aggregated usage data for an agent, or None if it can't be read.
+        
+        Returns the same ``UsageData`` the providers produce, so locally
+        recorded usage can be passed straight to ``ReceiptGenerator``.
+        """
         try:
             start_date = (datetime.now() - 
                          timedelta(days=days_back)).strftime("%Y-%m-%d")
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._lock:
+                self.flush()
+                cursor = self._conn.cursor()
                 
-                # Get total usage statistics
+                # Scan the period once, grouped per day and model, and
+                # derive the totals and breakdowns from the grouped rows
                 cursor.execute("""
                     SELECT 
-                        COUNT(*) as total_requests,
-                        SUM(prompt_tokens) as total_prompt_tokens,
-                        SUM(completion_tokens) as total_completion_tokens,
-                        SUM(total_tokens) as total_tokens,
-                        SUM(cost_usd) as total_cost
-                    FROM usage_records 
-                    WHERE agent_name = ? AND date(timestamp) >= ?
-                """, (agent_name, start_date))
-                
-                totals = cursor.fetchone()
-                
-                # Get model breakdown
-                cursor.execute("""
-                    SELECT model, COUNT(*) as requests
-                    FROM usage_records 
-                    WHERE agent_name = ? AND date(timestamp) >= ?
-                    GROUP BY model
-                """, (agent_name, start_date))
-                
-                models_used = dict(cursor.fetchall())
-                
-                # Get daily breakdown
-                cursor.execute("""
-                    SELECT 
-                        date(timestamp) as date,
+                        substr(timestamp, 1, 10) as date,
+                        model,
                         COUNT(*) as requests,
                         SUM(prompt_tokens) as prompt_tokens,
                         SUM(completion_tokens) as completion_tokens,
+                        SUM(total_tokens) as total_tokens,
                         SUM(cost_usd) as cost_usd
                     FROM usage_records 
-                    WHERE agent_name = ? AND date(timestamp) >= ?
-                    GROUP BY date(timestamp)
-                    ORDER BY date(timestamp)
+                    WHERE agent_name = ? AND substr(timestamp, 1, 10) >= ?
+                    GROUP BY substr(timestamp, 1, 10), model
+                    ORDER BY substr(timestamp, 1, 10)
                 """, (agent_name, start_date))
                 
-                daily_breakdown = []
-                for row in cursor.fetchall():
-                    daily_breakdown.append({
-                        "date": row[0],
-                        "requests": row[1],
-                        "prompt_tokens": row[2],
-                        "completion_tokens": row[3],
-                        "cost_usd": row[4]
-                    })
+                totals = [0, 0, 0, 0, 0.0]
+                models_used: Dict[str, int] = {}
+                daily: Dict[str, List[Any]] = {}
+                for (date, model, requests, prompt_tokens, completion_tokens,
+                     total_tokens, cost_usd) in cursor:
+                    totals[0] += requests
+                    totals[1] += prompt_tokens
+                    totals[2] += completion_tokens
+                    totals[3] += total_tokens
+                    totals[4] += cost_usd
+                    models_used[model] = models_used.get(model, 0) + requests
+                    
+                    day = daily.setdefault(date, [0, 0, 0, 0.0])
+                    day[0] += requests
+                    day[1] += prompt_tokens
+                    day[2] += completion_tokens
+                    day[3] += cost_usd
                 
-                return {
-                    "period_start": start_date,
-                    "period_end": datetime.now().strftime("%Y-%m-%d"),
-                    "total_requests": totals[0] or 0,
-                    "total_prompt_tokens": totals[1] or 0,
-                    "total_completion_tokens": totals[2] or 0,
-                    "total_tokens": totals[3] or 0,
-                    "total_cost_usd": totals[4] or 0.0,
-                    "models_used": models_used,
-                    "daily_breakdown": daily_breakdown
-                }
+                # Per-day (requests, prompt, completion, cost) columns
+                day_columns = list(zip(*daily.values())) or [(), (), (), ()]
+                
+                return UsageData.from_soa(
+                    list(daily), *day_columns,
+                    period_start=start_date,
+                    period_end=datetime.now().strftime("%Y-%m-%d"),
+                    total_requests=totals[0],
+                    total_prompt_tokens=totals[1],
+                    total_completion_tokens=totals[2],
+                    total_tokens=totals[3],
+                    total_cost_usd=totals[4],
+                    models_used=dict(sorted(models_used.items()))
+                )
                 
         except Exception as e:
             logger.error(f"Error getting usage data: {e}")
-            return {}
+            return None
     
     def save_receipt(self, agent_name: str, receipt_id: str, period_start: str,
                     period_end: str, total_cost: float, total_requests: int,
@@ -208,9 +392,7 @@ class LocalDatabase:
                     usage_data: Dict[str, Any]) -> bool:
         """Save receipt information to database."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self._transaction() as cursor:
                 cursor.execute("""
                     INSERT INTO receipt_history 
                     (agent_name, receipt_id, period_start, period_end, 
@@ -228,21 +410,21 @@ class LocalDatabase:
                     email_sent_to,
                     datetime.now().isoformat(),
                     schedule_type,
-                    json.dumps(usage_data)
+                    _json.dumps(usage_data).decode()
                 ))
                 
-                conn.commit()
-                return True
+            return True
         except Exception as e:
             logger.error(f"Error saving receipt: {e}")
             return False
     
     def get_receipt_history(self, agent_name: Optional[str] = None, 
-                          limit: int = 50) -> List[Dict[str, Any]]:
+                          limit: int = 50) -> List[Mapping[str, Any]]:
         """Get receipt history."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.row_factory = sqlite3.Row
                 
                 if agent_name:
                     cursor.execute("""
@@ -258,15 +440,7 @@ class LocalDatabase:
                         LIMIT ?
                     """, (limit,))
                 
-                columns = [desc[0] for desc in cursor.description]
-                receipts = []
-                
-                for row in cursor.fetchall():
-                    receipt = dict(zip(columns, row))
-                    receipt['usage_data_json'] = json.loads(receipt['usage_data_json'])
-                    receipts.append(receipt)
-                
-                return receipts
+                return [_ReceiptRecord(row) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error getting receipt history: {e}")
             return []
@@ -275,9 +449,7 @@ class LocalDatabase:
                  success: bool, error_message: Optional[str] = None) -> bool:
         """Log email sending activity."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
+            with self._transaction() as cursor:
                 cursor.execute("""
                     INSERT INTO email_logs 
                     (agent_name, to_email, subject, success, error_message, timestamp)
@@ -291,61 +463,24 @@ class LocalDatabase:
                     datetime.now().isoformat()
                 ))
                 
-                conn.commit()
-                return True
+            return True
         except Exception as e:
             logger.error(f"Error logging email: {e}")
             return False
     
-    def _update_daily_stats(self, agent_name: str, model: str, requests: int,
-                           tokens: int, cost: float) -> None:
-        """Update daily statistics for an agent."""
-        try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Get existing stats for today
-                cursor.execute("""
-                    SELECT total_requests, total_tokens, total_cost_usd, models_used_json
-                    FROM agent_stats 
-                    WHERE agent_name = ? AND date = ?
-                """, (agent_name, today))
-                
-                existing = cursor.fetchone()
-                
-                if existing:
-                    # Update existing record
-                    new_requests = existing[0] + requests
-                    new_tokens = existing[1] + tokens
-                    new_cost = existing[2] + cost
-                    
-                    models_used = json.loads(existing[3])
-                    models_used[model] = models_used.get(model, 0) + requests
-                    
-                    cursor.execute("""
-                        UPDATE agent_stats 
-                        SET total_requests = ?, total_tokens = ?, 
-                            total_cost_usd = ?, models_used_json = ?,
-                            updated_at = CURRENT_TIMESTAMP
-                        WHERE agent_name = ? AND date = ?
-                    """, (new_requests, new_tokens, new_cost, 
-                         json.dumps(models_used), agent_name, today))
-                else:
-                    # Create new record
-                    models_used = {model: requests}
-                    cursor.execute("""
-                        INSERT INTO agent_stats 
-                        (agent_name, date, total_requests, total_tokens, 
-                         total_cost_usd, models_used_json)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (agent_name, today, requests, tokens, cost, 
-                         json.dumps(models_used)))
-                
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Error updating daily stats: {e}")
+    def _update_daily_stats(self, cursor: sqlite3.Cursor, agent_name: str, model: str,
+                           requests: int, tokens: int, cost: float, date: str) -> None:
+        """Update one day's statistics for an agent within the caller's transaction."""
+        cursor.execute(_SQL_UPSERT_DAILY_STATS, {
+            "agent_name": agent_name,
+            "date": date,
+            "requests": requests,
+            "tokens": tokens,
+            "cost": cost,
+            "model": model,
+            # Quoted so model names with dots are a single path segment
+            "model_path": f'$."{model}"',
+        })
     
     def get_agent_summary(self, agent_name: str, days: int = 30) -> Dict[str, Any]:
         """Get summary statistics for an agent."""
@@ -353,8 +488,9 @@ class LocalDatabase:
             start_date = (datetime.now() - 
                          timedelta(days=days)).strftime("%Y-%m-%d")
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._lock:
+                self.flush()
+                cursor = self._conn.cursor()
                 
                 cursor.execute("""
                     SELECT 
@@ -387,30 +523,34 @@ class LocalDatabase:
             cutoff_date = (datetime.now() - 
                           timedelta(days=days_to_keep)).strftime("%Y-%m-%d")
             
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Remove old usage records
-                cursor.execute("""
-                    DELETE FROM usage_records 
-                    WHERE date(timestamp) < ?
-                """, (cutoff_date,))
-                
-                # Remove old email logs
-                cursor.execute("""
-                    DELETE FROM email_logs 
-                    WHERE date(timestamp) < ?
-                """, (cutoff_date,))
-                
-                # Remove old daily stats
-                cursor.execute("""
-                    DELETE FROM agent_stats 
-                    WHERE date < ?
-                """, (cutoff_date,))
-                
-                conn.commit()
-                logger.info(f"Cleaned up data older than {cutoff_date}")
-                return True
+            self.flush()
+            
+            # Remove old usage records, email logs and daily stats
+            self._delete_in_batches("usage_records", "substr(timestamp, 1, 10) < ?", cutoff_date)
+            self._delete_in_batches("email_logs", "substr(timestamp, 1, 10) < ?", cutoff_date)
+            self._delete_in_batches("agent_stats", "date < ?", cutoff_date)
+            
+            logger.info(f"Cleaned up data older than {cutoff_date}")
+            return True
         except Exception as e:
             logger.error(f"Error cleaning up old data: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    def _delete_in_batches(self, table: str, condition: str, *params: Any) -> None:
+        """
+        Delete the rows of ``table`` matching ``condition`` in bounded batches.
+        
+        Each batch is its own short transaction, so writers and readers can
+        run between batches instead of waiting for one large delete.
+        """
+        sql = f"""
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE {condition} LIMIT ?
+            )
+        """
+        while True:
+            with self._transaction() as cursor:
+                cursor.execute(sql, (*params, self.CLEANUP_BATCH_SIZE))
+                deleted = cursor.rowcount
+            if deleted < self.CLEANUP_BATCH_SIZE:
+                break
\ No newline at end of file
@@ -6,11 +6,110 @@ This example shows how to use Billfrog programmatically
 instead of through the CLI interface.
 """
 
-from billfrog.config import ConfigManager
-from billfrog.ai_providers.openai_provider import OpenAIProvider
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional, Tuple
+
+from billfrog.config import AgentConfig, ConfigManager
+from billfrog.ai_providers.openai_provider import UsageData, get_openai_provider
 from billfrog.receipts.generator import ReceiptGenerator
 from billfrog.email.sender import EmailSender
 
+# How many agents are fetched and rendered at the same time
+MAX_CONCURRENT_AGENTS = 10
+
+# How many receipt emails are sent at the same time in the background
+EMAIL_WORKERS = 4
+
+
+def agent_api_key(config_manager: ConfigManager, agent_name: str,
+                  agent_config: AgentConfig) -> Optional[str]:
+    """Get the API key to fetch an agent's usage with, or None if it can't be."""
+    # Get API key for the agent
+    api_key = config_manager.get_agent_api_key(agent_name)
+    if not api_key:
+        print(f"No API key found for agent {agent_name}")
+        return None
+    
+    if agent_config.provider != "openai":
+        print(f"Unsupported provider: {agent_config.provider}")
+        return None
+    
+    return api_key
+
+
+def fetch_usage(api_key: str) -> UsageData:
+    """Get the usage data for the last 7 days for an API key."""
+    # Agents that share an API key share one provider and its connections
+    return get_openai_provider(api_key).get_usage_data(days_back=7)
+
+
+def save_receipt(path: str, receipt_html: str) -> None:
+    """Write a receipt file as its UTF-8 bytes, without a buffered text layer."""
+    data = memoryview(receipt_html.encode("utf-8"))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        # A single write normally takes everything; loop in case it doesn't
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+
+async def build_receipts(config_manager: ConfigManager, agents: Dict[str, AgentConfig],
+                         on_receipt: Optional[Callable[[Tuple[str, str, str]], None]] = None
+                         ) -> Dict[str, Tuple[str, str, str]]:
+    """
+    Generate receipts for all agents concurrently, a bounded number at a time.
+    
+    ``on_receipt`` is called with each receipt as soon as it is ready, so it
+    can be sent while the remaining agents are still being processed.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_AGENTS)
+    # Usage fetches by API key, so agents that share a key share one fetch
+    usage_fetches: Dict[str, "asyncio.Future[UsageData]"] = {}
+    
+    async def process_agent(agent_name: str, agent_config: AgentConfig,
+                            render_pool: ProcessPoolExecutor):
+        api_key = agent_api_key(config_manager, agent_name, agent_config)
+        if api_key is None:
+            return None
+        
+        async with semaphore:
+            # Fetching usage waits on I/O, so run it on a worker thread
+            if api_key not in usage_fetches:
+                usage_fetches[api_key] = loop.run_in_executor(None, fetch_usage, api_key)
+            usage_data = await usage_fetches[api_key]
+            
+            # Rendering is CPU-bound, so spread it across worker processes
+            print(f"Generating receipt for agent: {agent_name}")
+            receipt_html = await loop.run_in_executor(
+                render_pool, ReceiptGenerator.render, agent_name, usage_data, agent_config.schedule
+            )
+        
+        receipt = (agent_config.email, f"Test Receipt for {agent_name}", receipt_html)
+        if on_receipt is not None:
+            on_receipt(receipt)
+        return receipt
+    
+    # Spawn rather than fork workers, since forking while the fetch and email
+    # threads are running can deadlock
+    with ProcessPoolExecutor(max_workers=min(len(agents), os.cpu_count() or 1),
+                             mp_context=multiprocessing.get_context("spawn")) as render_pool:
+        results = await asyncio.gather(
+            *(process_agent(agent_name, agent_config, render_pool)
+              for agent_name, agent_config in agents.items())
+        )
+    return {
+        agent_name: receipt
+        for agent_name, receipt in zip(agents, results)
+        if receipt is not None
+    }
+
+
 def main():
     """Example of programmatic billfrog usage."""
     
@@ -23,58 +122,37 @@ def main():
         print("No agents configured. Use 'billfrog agent add' first.")
         return
     
-    # Get the first agent
-    agent_name = list(agents.keys())[0]
-    agent_config = agents[agent_name]
-    
-    print(f"Generating receipt for agent: {agent_name}")
-    
-    # Get API key for the agent
-    api_key = config_manager.get_agent_api_key(agent_name)
-    if not api_key:
-        print(f"No API key found for agent {agent_name}")
-        return
+    # Get Supabase configuration
+    supabase_url, supabase_key = config_manager.get_supabase_config()
     
-    # Initialize OpenAI provider
-    if agent_config.provider == "openai":
-        provider = OpenAIProvider(api_key)
+    if supabase_url and supabase_key:
+        email_sender = EmailSender(supabase_url, supabase_key)
         
-        # Get usage data for the last 7 days
-        usage_data = provider.get_usage_data(days_back=7)
-        
-        # Generate receipt
-        receipt_generator = ReceiptGenerator()
-        receipt_html = receipt_generator.generate_receipt(
-            agent_name, usage_data, agent_config.schedule
-        )
-        
-        # Get Supabase configuration
-        supabase_url, supabase_key = config_manager.get_supabase_config()
-        
-        if supabase_url and supabase_key:
-            # Send email
-            email_sender = EmailSender(supabase_url, supabase_key)
-            success = email_sender.send_receipt(
-                agent_config.email,
-                f"Test Receipt for {agent_name}",
-                receipt_html
-            )
+        # Hand each receipt to a background sender as soon as it is generated,
+        # and only wait for the sends once every receipt is done
+        with ThreadPoolExecutor(max_workers=EMAIL_WORKERS,
+                                thread_name_prefix="billfrog-email") as email_pool:
+            futures = {}
             
-            if success:
-                print(f"✅ Receipt sent to {agent_config.email}")
-            else:
-                print(f"❌ Failed to send receipt")
-        else:
-            print("📧 Supabase not configured, saving receipt to file")
+            def send(receipt: Tuple[str, str, str]) -> None:
+                futures[email_pool.submit(email_sender.send_receipt, *receipt)] = receipt[0]
             
-            # Save to file instead
-            with open(f"receipt_{agent_name}.html", "w") as f:
-                f.write(receipt_html)
-            print(f"💾 Receipt saved to receipt_{agent_name}.html")
-    
+            asyncio.run(build_receipts(config_manager, agents, on_receipt=send))
+            
+            for future in as_completed(futures):
+                if future.result():
+                    print(f"✅ Receipt sent to {futures[future]}")
+                else:
+                    print(f"❌ Failed to send receipt to {futures[future]}")
     else:
-        print(f"Unsupported provider: {agent_config.provider}")
+        print("📧 Supabase not configured, saving receipts to files")
+        
+        # Generate a receipt for every agent and save them to files instead
+        receipts = asyncio.run(build_receipts(config_manager, agents))
+        for agent_name, (_, _, receipt_html) in receipts.items():
+            save_receipt(f"receipt_{agent_name}.html", receipt_html)
+            print(f"💾 Receipt saved to receipt_{agent_name}.html")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
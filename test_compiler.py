@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Check that compiled receipt renderers match Jinja.
+
+Every template here is rendered both by ``compile_renderer`` and by the
+Jinja environment the receipt generator falls back to, and the output
+must be identical.
+"""
+
+import pytest
+
+from billfrog.receipts.compiler import compile_renderer
+from billfrog.receipts.generator import _ENV, _RECEIPT_TEMPLATE_SRC
+from markupsafe import Markup
+
+
+class Item:
+    """A plain object, looked up by attribute."""
+    
+    def __init__(self, name, price):
+        self.name = name
+        self.price = price
+
+
+CONTEXT = {
+    "agent_name": "Agent <Smith> & Co",
+    "safe_html": Markup("<b>bold</b>"),
+    "total": 12.5,
+    "summary": {"requests": "1,024", "tokens": 0, "items": "not a method"},
+    "rows": [{"date": "Jan 01", "cost": 1.5}, {"date": "Jan 02", "cost": None}],
+    "grid": [[1, 2], [3]],
+    "objects": [Item("a", 1), Item("<b>", 2)],
+    "empty": [],
+}
+
+TEMPLATES = [
+    "plain text only",
+    "{{ agent_name }}",
+    "{{ safe_html }} and {{ total }}",
+    "{{summary.requests}}/{{ summary.tokens }}",
+    "{{ summary.items }}",
+    "{{ missing }}|{{ summary.missing }}",
+    "{% for row in rows %}<tr>{{ row.date }}: {{ row.cost }}</tr>{% endfor %}",
+    "{% for row in grid %}[{% for cell in row %}{{ cell }},{% endfor %}]{% endfor %}",
+    "{% for item in objects %}{{ item.name }}={{ item.price }};{% endfor %}",
+    "{% for row in empty %}never{% endfor %}done",
+    "{% for rows in rows %}{{ rows.date }}{% endfor %}{{ rows }}",
+    "{{ range }}",
+    "{{ dict }}",
+    "trailing newline\n",
+    "two trailing newlines\n\n",
+]
+
+
+@pytest.mark.parametrize("source", TEMPLATES)
+def test_compiled_matches_jinja(source):
+    """Compiled renderers produce exactly what Jinja renders."""
+    renderer = compile_renderer(source, _ENV)
+    assert renderer is not None, f"Template was not compiled: {source!r}"
+    assert renderer(CONTEXT) == _ENV.from_string(source).render(CONTEXT)
+
+
+def test_context_shadows_globals():
+    """A context value wins over an environment global of the same name."""
+    source = "{{ range }}"
+    context = {"range": "shadowed"}
+    assert compile_renderer(source, _ENV)(context) == _ENV.from_string(source).render(context)
+
+
+def test_receipt_template_matches_jinja():
+    """The stock receipt template is compiled and renders like Jinja."""
+    context = dict(
+        CONTEXT,
+        period={"start": "January 01, 2024", "end": "January 31, 2024"},
+        usage_summary={"total_requests": "10", "total_tokens": "1,500"},
+        models_breakdown=[{"name": "GPT-4", "requests": "10"}],
+        daily_rows=Markup("<tr><td>Jan 01</td></tr>"),
+    )
+    renderer = compile_renderer(_RECEIPT_TEMPLATE_SRC, _ENV)
+    assert renderer is not None
+    assert renderer(context) == _ENV.from_string(_RECEIPT_TEMPLATE_SRC).render(context)
+
+
+@pytest.mark.parametrize("source", [
+    "{% if agent_name %}x{% endif %}",
+    "{{ agent_name|upper }}",
+    "{# comment #}",
+    "{% for row in rows %}{{ loop.index }}{% endfor %}",
+    "{% for row in rows %}unclosed",
+])
+def test_unsupported_templates_fall_back(source):
+    """Templates outside the supported subset are left to Jinja."""
+    assert compile_renderer(source, _ENV) is None
@@ -2,128 +2,130 @@
 """
 Test script to verify Billfrog package structure.
 This tests basic imports and structure without external dependencies.
+
+Run with ``pytest test_package.py``, or ``pytest -n auto test_package.py``
+to run the checks in parallel with pytest-xdist.
 """
 
+import contextlib
+import functools
+import importlib.util
+import mmap
+import os
+import re
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@functools.lru_cache(maxsize=None)
+def _list_dir(directory):
+    """Names of the entries directly in ``directory``, from one non-recursive scan."""
+    with os.scandir(directory) as entries:
+        return frozenset(entry.name for entry in entries)
+
+
+def _exists(root, path):
+    """Whether the '/'-separated ``path`` exists under ``root``, scanning only its parent directory."""
+    parent, _, name = path.rpartition("/")
+    return name in _list_dir(os.path.join(root, parent))
+
+
+def _find_all(needles, content):
+    """Return which of ``needles`` occur in the bytes of ``content``, in a single regex scan."""
+    # A lookahead tries every position, so overlapping needles are all found
+    alternation = b"|".join(re.escape(needle.encode()) for needle in needles)
+    return {match.decode() for match in re.findall(b"(?=(" + alternation + b"))", content)}
+
+
+@contextlib.contextmanager
+def _mapped(file_name):
+    """Memory-map a file from the repository root, so it is scanned without copying or decoding it."""
+    with open(os.path.join(ROOT, file_name), "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        yield content
+
+
 def test_basic_imports():
     """Test basic package imports."""
-    print("🔍 Testing basic package imports...")
+    # Locate the package without importing it, so none of its dependencies load
+    spec = importlib.util.find_spec("billfrog")
+    assert spec is not None and spec.origin, "Package 'billfrog' not found"
+    package_dir = os.path.dirname(spec.origin)
+    
+    # Read the version and author straight from the package source
+    init_source = Path(spec.origin).read_text()
+    for name in ("__version__", "__author__"):
+        match = re.search(rf"^{name}\s*=\s*[\"']([^\"']+)[\"']", init_source, re.MULTILINE)
+        assert match, f"Missing {name} in billfrog/__init__.py"
+    
+    # Check that all module files exist (without importing dependencies)
+    expected_files = {
+        "__init__.py",
+        "config.py",
+        "cli.py",
+        "ai_providers/__init__.py",
+        "ai_providers/openai_provider.py",
+        "email/__init__.py",
+        "email/sender.py",
+        "receipts/__init__.py",
+        "receipts/generator.py",
+        "scheduler/__init__.py",
+        "scheduler/task_scheduler.py",
+        "storage/__init__.py",
+        "storage/database.py",
+    }
+    
+    missing = {path for path in expected_files if not _exists(package_dir, path)}
+    assert not missing, f"Missing: {sorted(missing)}"
+    
+    # Check packaging files
+    packaging_files = [
+        "pyproject.toml",
+        "requirements.txt",
+        "README.md",
+        "LICENSE",
+        "MANIFEST.in"
+    ]
     
-    try:
-        # Test version import
-        from billfrog import __version__, __author__
-        print(f"✅ Package version: {__version__}")
-        print(f"✅ Package author: {__author__}")
-        
-        # Test individual module existence (without importing dependencies)
-        import os
-        import sys
-        
-        # Add current directory to path
-        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-        
-        # Check that all module files exist
-        expected_files = [
-            "billfrog/__init__.py",
-            "billfrog/config.py",
-            "billfrog/cli.py",
-            "billfrog/ai_providers/__init__.py",
-            "billfrog/ai_providers/openai_provider.py",
-            "billfrog/email/__init__.py",
-            "billfrog/email/sender.py",
-            "billfrog/receipts/__init__.py",
-            "billfrog/receipts/generator.py",
-            "billfrog/scheduler/__init__.py",
-            "billfrog/scheduler/task_scheduler.py",
-            "billfrog/storage/__init__.py",
-            "billfrog/storage/database.py",
-        ]
-        
-        for file_path in expected_files:
-            if os.path.exists(file_path):
-                print(f"✅ Found: {file_path}")
-            else:
-                print(f"❌ Missing: {file_path}")
-                return False
-        
-        # Check packaging files
-        packaging_files = [
-            "pyproject.toml",
-            "requirements.txt",
-            "README.md",
-            "LICENSE",
-            "MANIFEST.in"
-        ]
-        
-        for file_path in packaging_files:
-            if os.path.exists(file_path):
-                print(f"✅ Found packaging file: {file_path}")
-            else:
-                print(f"❌ Missing packaging file: {file_path}")
-        
-        print("\n🎉 Basic package structure test passed!")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Import test failed: {e}")
-        return False
+    for file_path in packaging_files:
+        assert _exists(ROOT, file_path), f"Missing packaging file: {file_path}"
+
 
 def test_package_metadata():
     """Test package metadata."""
-    print("\n📦 Testing package metadata...")
+    required_sections = [
+        "[build-system]",
+        "[project]",
+        "name = \"billfrog\"",
+        "version = \"0.1.0\"",
+        "billfrog = \"billfrog.cli:main\""
+    ]
+    
+    # Check pyproject.toml
+    with _mapped("pyproject.toml") as content:
+        found = _find_all(required_sections, content)
+    for section in required_sections:
+        assert section in found, f"Missing in pyproject.toml: {section}"
+    
+    required_deps = [
+        "typer",
+        "rich",
+        "openai",
+        "supabase",
+        "jinja2",
+        "cryptography"
+    ]
     
-    try:
-        # Read pyproject.toml
-        with open("pyproject.toml", "r") as f:
-            content = f.read()
-            
-        required_sections = [
-            "[build-system]",
-            "[project]",
-            "name = \"billfrog\"",
-            "version = \"0.1.0\"",
-            "billfrog = \"billfrog.cli:main\""
-        ]
-        
-        for section in required_sections:
-            if section in content:
-                print(f"✅ Found in pyproject.toml: {section}")
-            else:
-                print(f"❌ Missing in pyproject.toml: {section}")
-                return False
-        
-        # Check requirements.txt
-        with open("requirements.txt", "r") as f:
-            requirements = f.read()
-            
-        required_deps = [
-            "typer",
-            "rich", 
-            "openai",
-            "supabase",
-            "jinja2",
-            "schedule",
-            "cryptography"
-        ]
-        
-        for dep in required_deps:
-            if dep in requirements:
-                print(f"✅ Found dependency: {dep}")
-            else:
-                print(f"❌ Missing dependency: {dep}")
-                return False
-        
-        print("✅ Package metadata test passed!")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Metadata test failed: {e}")
-        return False
+    # Check requirements.txt
+    with _mapped("requirements.txt") as requirements:
+        found = _find_all(required_deps, requirements)
+    for dep in required_deps:
+        assert dep in found, f"Missing dependency: {dep}"
+
 
 def test_examples():
     """Test example files."""
-    print("\n📝 Testing example files...")
-    import os
-    
     example_files = [
         "examples/basic_usage.py",
         "examples/custom_receipt.py",
@@ -131,47 +133,4 @@ def test_examples():
     ]
     
     for file_path in example_files:
-        if os.path.exists(file_path):
-            print(f"✅ Found example: {file_path}")
-        else:
-            print(f"❌ Missing example: {file_path}")
-            return False
-    
-    print("✅ Example files test passed!")
-    return True
-
-def main():
-    """Run all tests."""
-    print("🐸 Billfrog Package Structure Test")
-    print("=" * 40)
-    
-    tests = [
-        test_basic_imports,
-        test_package_metadata,
-        test_examples
-    ]
-    
-    passed = 0
-    total = len(tests)
-    
-    for test in tests:
-        if test():
-            passed += 1
-        print()
-    
-    print("=" * 40)
-    print(f"📊 Test Results: {passed}/{total} tests passed")
-    
-    if passed == total:
-        print("🎉 All tests passed! Package structure looks good.")
-        print("\n📦 Ready for installation with:")
-        print("   pip install -e .")
-        print("   # or")
-        print("   pip install billfrog")
-    else:
-        print("❌ Some tests failed. Please check the package structure.")
-    
-    return passed == total
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+        assert _exists(ROOT, file_path), f"Missing example: {file_path}"